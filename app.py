@@ -1,9 +1,44 @@
-from flask import Flask, render_template, send_from_directory, redirect, url_for, request, session, flash, jsonify
+from flask import Flask, Response, abort, render_template, send_from_directory, redirect, url_for, request, session, flash, jsonify, g, has_app_context
+from flask import before_render_template, template_rendered
 import sqlite3
 from pathlib import Path
 import os
+import threading
+import json
+import queue
+import select
+import sys
+import base64
+import re
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
+import gzip
+import hashlib
+import hmac
+import mimetypes
+import tempfile
+from urllib.parse import urlsplit
 from werkzeug.utils import secure_filename
+from werkzeug.security import check_password_hash, generate_password_hash, safe_join
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup, escape
+import click
 from dotenv import load_dotenv
+import railway_config
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не установлен: уменьшенные копии не создаются
+    Image = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # pypdfium2 не установлен: PDF не разбираются, превью нет
+    pdfium = None
 
 # Load environment variables
 load_dotenv()
@@ -39,11 +74,11 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 if DATABASE_URL:
     # Use PostgreSQL for production (Railway)
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import DictCursor
     DB_TYPE = 'postgresql'
 else:
     # Use SQLite for development
-    DB_PATH = Path(__file__).with_name('data.db')
+    DB_PATH = Path(os.getenv('SQLITE_PATH', Path(__file__).with_name('data.db')))
     DB_TYPE = 'sqlite'
 
 # Upload folder configuration
@@ -55,24 +90,745 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB default
 
 
-def get_db():
+# Connection pool settings (env overrides railway_config defaults)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', railway_config.DB_POOL_SIZE))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', railway_config.DB_MAX_OVERFLOW))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', railway_config.DB_POOL_TIMEOUT))
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', railway_config.DB_POOL_RECYCLE))
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за DB_POOL_TIMEOUT секунд"""
+
+
+class ConnectionPool:
+    """Пул соединений: pool_size постоянных плюс до max_overflow временных"""
+
+    def __init__(self, connect, pool_size, max_overflow, timeout, recycle):
+        self._connect = connect
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self._idle = deque()  # (conn, created_at)
+        self._checked_out = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'connects': 0,
+            'recycled': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def checkout(self):
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at = self._idle.pop()
+                    break
+                if self._checked_out < self.pool_size + self.max_overflow:
+                    conn, created_at = None, None
+                    break
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'Нет свободных соединений за {self.timeout} с')
+                self._cond.wait(remaining)
+            self._checked_out += 1
+
+        try:
+            if conn is not None and (time.time() - created_at > self.recycle or getattr(conn, 'closed', 0)):
+                self._close_quietly(conn)
+                conn = None
+                with self._cond:
+                    self._stats['recycled'] += 1
+            if conn is None:
+                conn = self._connect()
+                created_at = time.time()
+                with self._cond:
+                    self._stats['connects'] += 1
+        except Exception:
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        return conn, created_at
+
+    def release(self, conn, created_at):
+        # Незакоммиченное откатываем, как это делал бы conn.close()
+        try:
+            conn.rollback()
+            healthy = not getattr(conn, 'closed', 0)
+        except Exception:
+            healthy = False
+        with self._cond:
+            self._checked_out -= 1
+            keep = healthy and len(self._idle) < self.pool_size
+            if keep:
+                self._idle.append((conn, created_at))
+            else:
+                self._stats['discarded'] += 1
+            self._cond.notify()
+        if not keep:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                idle=len(self._idle),
+                checked_out=self._checked_out,
+            )
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+@lru_cache(maxsize=512)
+def prepare_sql(sql, has_params=True):
+    """Перевести SQL с плейсхолдерами '?' в диалект текущей БД.
+
+    Результат кэшируется, так что разбор каждого запроса делается один раз
+    на процесс. Для PostgreSQL '?' вне строковых литералов превращается в %s,
+    а литеральный '%' экранируется (только если передаются параметры).
+    """
+    if DB_TYPE != 'postgresql':
+        return sql
+    out = []
+    quote = None
+    for ch in sql:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '?':
+            out.append('%s')
+            continue
+        if ch == '%' and has_params:
+            out.append('%%')
+            continue
+        out.append(ch)
+    return ''.join(out)
+
+
+class DbCursor:
+    """Курсор, принимающий SQL в стиле sqlite ('?') для обеих БД.
+
+    Строки в обоих случаях поддерживают доступ и по индексу, и по имени
+    колонки (sqlite3.Row / psycopg2 DictRow), а также dict(row).
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            if params is None:
+                self._raw.execute(prepare_sql(sql, False))
+            else:
+                self._raw.execute(prepare_sql(sql), params)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        started = time.perf_counter()
+        try:
+            self._raw.executemany(prepare_sql(sql), seq_of_params)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+        return self
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class PooledConnection:
+    """Соединение из пула. close() не закрывает его, а возвращает в пул"""
+
+    def __init__(self, pool, raw, created_at, request_scoped=False):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._request_scoped = request_scoped
+
+    def close(self):
+        if self._request_scoped:
+            # Соединение живет до конца запроса (см. release_db)
+            self._raw.rollback()
+        else:
+            self.release()
+
+    def release(self):
+        if self._raw is not None:
+            self._pool.release(self._raw, self._created_at)
+            self._raw = None
+
+    def cursor(self):
+        return DbCursor(self._raw.cursor())
+
+    def execute(self, sql, params=None):
+        """Аналог sqlite3.Connection.execute, работающий и на PostgreSQL"""
+        return self.cursor().execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def _connect():
     if DB_TYPE == 'postgresql':
         conn = psycopg2.connect(DATABASE_URL)
-        conn.cursor_factory = RealDictCursor
+        conn.cursor_factory = DictCursor
         return conn
     else:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(DB_PATH, timeout=DB_POOL_TIMEOUT, check_same_thread=False, cached_statements=256)
         conn.row_factory = sqlite3.Row
         return conn
 
 
+db_pool = ConnectionPool(_connect, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE)
+
+
+def get_db():
+    """Соединение с БД из пула; внутри запроса одно и то же на весь запрос"""
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            raw, created_at = db_pool.checkout()
+            conn = g._db_conn = PooledConnection(db_pool, raw, created_at, request_scoped=True)
+        return conn
+    raw, created_at = db_pool.checkout()
+    return PooledConnection(db_pool, raw, created_at)
+
+
+# ------------------ Instrumentation ------------------
+# Для каждого запроса считаются общее время, время в БД, в шаблонах и на
+# запись загрузок, а также число запросов к БД. Агрегаты по эндпоинтам
+# отдают /metrics (формат Prometheus) и /admin/db/queries, время текущего
+# запроса — заголовки Server-Timing и X-Query-Count. Запросы к БД дольше
+# SLOW_QUERY_MS пишутся в лог. Метрики живут в памяти процесса: у каждого
+# воркера gunicorn свои, Prometheus суммирует их по instance.
+QUERY_COUNT_WARN = int(os.getenv('QUERY_COUNT_WARN', 20))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REQUEST_TIMINGS = ('db', 'template', 'upload')
+STATEMENT_STATS_MAX = 500  # различных текстов SQL в статистике
+query_stats = {}
+statement_stats = {}
+slow_queries = deque(maxlen=50)
+instrumentation_counters = {'slow_queries': 0}
+query_stats_lock = threading.Lock()
+
+
+def add_timing(kind, seconds):
+    if has_app_context():
+        timings = g.setdefault('_timings', dict.fromkeys(REQUEST_TIMINGS, 0.0))
+        timings[kind] += seconds
+
+
+@contextmanager
+def timed(kind):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(kind, time.perf_counter() - started)
+
+
+def record_query(sql, elapsed):
+    endpoint = None
+    if has_app_context():
+        g._query_count = g.get('_query_count', 0) + 1
+        add_timing('db', elapsed)
+        endpoint = request.endpoint if request else None
+    statement = ' '.join(sql.split())[:200]
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    with query_stats_lock:
+        stats = statement_stats.get(statement)
+        if stats is None and len(statement_stats) < STATEMENT_STATS_MAX:
+            stats = statement_stats[statement] = {'calls': 0, 'time': 0.0, 'max_time': 0.0}
+        if stats is not None:
+            stats['calls'] += 1
+            stats['time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+        if slow:
+            instrumentation_counters['slow_queries'] += 1
+            slow_queries.append({'ms': round(elapsed * 1000, 1), 'endpoint': endpoint, 'sql': statement,
+                                 'at': datetime.now(timezone.utc).isoformat(timespec='seconds')})
+    if slow:
+        app.logger.warning('SLOW QUERY %.0f ms [%s]: %s', elapsed * 1000, endpoint or '-', statement)
+
+
+@before_render_template.connect_via(app)
+def template_render_started(sender, template, context, **extra):
+    g._template_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def template_render_finished(sender, template, context, **extra):
+    started = g.pop('_template_started', None)
+    if started is not None:
+        add_timing('template', time.perf_counter() - started)
+
+
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+    if sampling_profiler.enabled:
+        sampling_profiler.enter(request.endpoint or 'unknown')
+
+
+@app.after_request
+def record_request_metrics(response):
+    duration = time.perf_counter() - g.get('_request_started', time.perf_counter())
+    count = g.get('_query_count', 0)
+    timings = g.get('_timings') or dict.fromkeys(REQUEST_TIMINGS, 0.0)
+    endpoint = request.endpoint or 'unknown'
+    with query_stats_lock:
+        stats = query_stats.get(endpoint)
+        if stats is None:
+            stats = query_stats[endpoint] = {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'time': 0.0, 'max_time': 0.0,
+                'buckets': [0] * len(REQUEST_DURATION_BUCKETS),
+                **{f'{kind}_time': 0.0 for kind in REQUEST_TIMINGS},
+            }
+        stats['requests'] += 1
+        stats['queries'] += count
+        stats['max_queries'] = max(stats['max_queries'], count)
+        stats['time'] += duration
+        stats['max_time'] = max(stats['max_time'], duration)
+        for kind in REQUEST_TIMINGS:
+            stats[f'{kind}_time'] += timings[kind]
+        for i, bound in enumerate(REQUEST_DURATION_BUCKETS):
+            if duration <= bound:
+                stats['buckets'][i] += 1
+                break
+    if count > QUERY_COUNT_WARN:
+        app.logger.warning('%s made %d queries', endpoint, count)
+    response.headers['X-Query-Count'] = str(count)
+    response.headers['Server-Timing'] = ', '.join(
+        [f'{kind};dur={timings[kind] * 1000:.1f}' for kind in REQUEST_TIMINGS] + [f'total;dur={duration * 1000:.1f}']
+    )
+    return response
+
+
+@app.teardown_request
+def stop_request_profiling(exc):
+    if sampling_profiler.enabled:
+        sampling_profiler.leave()
+
+
+def green_threads():
+    """True под gevent с monkey-patching: «потоки» — гринлеты одного OS-потока"""
+    monkey = sys.modules.get('gevent.monkey')
+    return bool(monkey and monkey.is_module_patched('threading'))
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик: раз в interval снимает стеки потоков,
+    обслуживающих запросы, и считает их по эндпоинтам.
+
+    Не замедляет сами запросы (в отличие от cProfile) и работает с
+    несколькими потоками; результат — свернутые стеки для flamegraph.pl
+    или speedscope.
+    """
+
+    def __init__(self, interval=0.005, max_depth=48):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.enabled = False
+        self.samples = Counter()
+        self.started_at = None
+        self._active = {}  # thread id -> endpoint
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enter(self, endpoint):
+        self._active[threading.get_ident()] = endpoint
+
+    def leave(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def start(self):
+        """Включить; False под gevent, где get_ident() — id гринлета и не
+        совпадает с ключами sys._current_frames(), то есть семплов не будет"""
+        if green_threads():
+            print('Sampling profiler is not supported with gevent workers; use gthread')
+            return False
+        with self._lock:
+            self.enabled = True
+            self.started_at = self.started_at or datetime.now(timezone.utc).isoformat(timespec='seconds')
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+        return True
+
+    def stop(self):
+        self.enabled = False
+        self._active.clear()
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds') if self.enabled else None
+
+    def _run(self):
+        while self.enabled:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, endpoint in list(self._active.items()):
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        code = frame.f_code
+                        stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                        frame = frame.f_back
+                    if stack:
+                        self.samples[endpoint + ';' + ';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        with self._lock:
+            return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common())
+
+    def summary(self, limit=30):
+        """Доля семплов по эндпоинтам и по функциям на вершине стека"""
+        by_endpoint, by_function = Counter(), Counter()
+        with self._lock:
+            for stack, count in self.samples.items():
+                frames = stack.split(';')
+                by_endpoint[frames[0]] += count
+                by_function[frames[-1]] += count
+            total = sum(self.samples.values())
+        return {
+            'enabled': self.enabled,
+            'started_at': self.started_at,
+            'interval_ms': self.interval * 1000,
+            'samples': total,
+            'endpoints': by_endpoint.most_common(limit),
+            'functions': by_function.most_common(limit),
+        }
+
+
+sampling_profiler = SamplingProfiler(float(os.getenv('PROFILER_INTERVAL_MS', 5)) / 1000)
+if os.getenv('PROFILER_ENABLED', '0') == '1':
+    sampling_profiler.start()
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.release()
+
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+# ------------------ Background jobs ------------------
+# Побочные эффекты отправки форм (уведомления, уменьшенные копии картинок,
+# разбор PDF) записываются в background_jobs в той же транзакции, что и
+# сами данные, и выполняются пулом потоков. Задача забирается атомарным
+# UPDATE ... RETURNING (на PostgreSQL с FOR UPDATE SKIP LOCKED), поэтому
+# несколько процессов gunicorn не выполнят ее дважды; упавшие задачи
+# повторяются с экспоненциальной задержкой, зависшие (воркер умер)
+# забираются снова через JOB_LOCK_TIMEOUT. JOB_WORKERS=0 — потоки не
+# запускаются, задачи выполняет отдельный процесс flask run-jobs.
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 2))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BACKOFF = 10  # секунд до первого повтора, далее удваивается
+JOB_LOCK_TIMEOUT = 600
+JOB_HANDLERS = {}
+job_wakeup = threading.Event()
+
+
+def job_handler(kind):
+    def decorator(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def enqueue_job(cur, kind, max_attempts=JOB_MAX_ATTEMPTS, **payload):
+    """Добавить задачу курсором вызывающего (коммитится вместе с его данными).
+
+    После commit вызовите wake_job_workers(), иначе задача будет взята
+    при следующем опросе очереди.
+    """
+    cur.execute('INSERT INTO background_jobs(kind, payload, max_attempts, run_after) VALUES(?, ?, ?, ?)',
+                (kind, json.dumps(payload, ensure_ascii=False), max_attempts, time.time()))
+
+
+def wake_job_workers():
+    job_wakeup.set()
+
+
+def claim_job():
+    """Забрать одну готовую задачу или None"""
+    now = time.time()
+    skip_locked = 'FOR UPDATE SKIP LOCKED' if DB_TYPE == 'postgresql' else ''
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(f'''
+            UPDATE background_jobs SET status = 'running', locked_at = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM background_jobs
+                WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND locked_at < ?)
+                ORDER BY run_after, id
+                LIMIT 1 {skip_locked}
+            )
+            RETURNING id, kind, payload, attempts, max_attempts
+        ''', (now, now, now - JOB_LOCK_TIMEOUT))
+        row = cur.fetchone()
+        job = dict(row) if row else None
+        conn.commit()
+        return job
+    finally:
+        conn.close()
+
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job['kind'])
+    error = None
+    try:
+        if handler is None:
+            raise LookupError(f"unknown job kind {job['kind']}")
+        handler(**json.loads(job['payload'] or '{}'))
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'[:1000]
+        print(f"Job {job['id']} ({job['kind']}) failed, attempt {job['attempts']}: {error}")
+
+    conn = get_db()
+    try:
+        if error is None:
+            conn.execute("UPDATE background_jobs SET status = 'done', finished_at = ?, last_error = NULL WHERE id = ?",
+                         (time.time(), job['id']))
+        elif handler is not None and job['attempts'] < job['max_attempts']:
+            delay = JOB_RETRY_BACKOFF * 2 ** (job['attempts'] - 1)
+            conn.execute("UPDATE background_jobs SET status = 'queued', run_after = ?, last_error = ? WHERE id = ?",
+                         (time.time() + delay, error, job['id']))
+        else:
+            conn.execute("UPDATE background_jobs SET status = 'failed', finished_at = ?, last_error = ? WHERE id = ?",
+                         (time.time(), error, job['id']))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_pending_jobs():
+    """Выполнить все готовые задачи; вернуть их число"""
+    count = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+def job_worker():
+    while True:
+        try:
+            if run_pending_jobs():
+                continue
+        except Exception as e:
+            print(f"Job worker error: {e}")
+        job_wakeup.wait(JOB_POLL_INTERVAL)
+        job_wakeup.clear()
+
+
+def start_job_workers(count=JOB_WORKERS):
+    for i in range(count):
+        threading.Thread(target=job_worker, name=f'job-worker-{i}', daemon=True).start()
+
+
+# ------------------ Upload store ------------------
+# Загрузки пишутся потоково во временный файл с подсчётом SHA-256 и затем
+# атомарно переименовываются в uploads/<aa>/<bb>/<sha256>.<ext>. Одинаковые
+# файлы хранятся один раз; размер и MIME записываются в таблицу uploads.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_TMP_FOLDER = UPLOAD_FOLDER / '.tmp'
+UPLOAD_TMP_FOLDER.mkdir(exist_ok=True)
+# mkstemp создает файлы с правами 0600, а os.replace их сохраняет. Файлы
+# из uploads читает и прокси (STATIC_OFFLOAD) под другим пользователем,
+# поэтому перед публикацией права выставляются как у обычного файла
+_umask = os.umask(0)
+os.umask(_umask)
+PUBLISHED_FILE_MODE = 0o644 & ~_umask
+
+# Сигнатуры форматов: MIME определяем по содержимому, а не по имени файла
+MAGIC_NUMBERS = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+]
+
+
+def sniff_mime(head, filename):
+    for magic, mime in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def store_upload(cur, file):
+    """Сохранить загруженный файл в хранилище; вернуть URL /uploads/... или None.
+
+    Запись в uploads делается курсором вызывающего и коммитится вместе с
+    его данными.
+    """
+    if not file or not file.filename or not allowed_file(file.filename):
+        return None
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_TMP_FOLDER)
+    os.fchmod(fd, PUBLISHED_FILE_MODE)
+    try:
+        with timed('upload'), os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if not head:
+                    head = chunk[:16]
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+
+        cur.execute('SELECT path FROM uploads WHERE sha256 = ?', (sha256,))
+        row = cur.fetchone()
+        if row and (UPLOAD_FOLDER / row['path']).exists():
+            os.unlink(tmp_path)
+            return f"/uploads/{row['path']}"
+
+        rel_path = f'{sha256[:2]}/{sha256[2:4]}/{sha256}.{ext}'
+        target = UPLOAD_FOLDER / rel_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, target)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    mime = sniff_mime(head, file.filename)
+    cur.execute('''INSERT INTO uploads(sha256, path, size, mime, original_name) VALUES(?, ?, ?, ?, ?)
+                   ON CONFLICT(sha256) DO UPDATE SET path = excluded.path''',
+                (sha256, rel_path, size, mime, secure_filename(file.filename)))
+    if mime.startswith('image/'):
+        # Уменьшенные копии готовятся заранее, а не при первом просмотре
+        enqueue_job(cur, 'image_variants', path=rel_path)
+    return f'/uploads/{rel_path}'
+
+
+# ------------------ Image variants ------------------
+# Уменьшенные копии картинок из uploads/ создаются при первом запросе
+# /uploads/<path>?w=<ширина> и кэшируются на диске в uploads/.variants.
+# Формат — WebP, если браузер его принимает, иначе JPEG. Без Pillow
+# отдается оригинал.
+IMAGE_VARIANT_WIDTHS = (160, 480, 960)
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_FOLDER = UPLOAD_FOLDER / '.variants'
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+
+def image_variant(filename, width, fmt):
+    """Путь к варианту картинки относительно UPLOAD_FOLDER (создается при необходимости) или None"""
+    if Image is None or width not in IMAGE_VARIANT_WIDTHS:
+        return None
+    if filename.rsplit('.', 1)[-1].lower() not in IMAGE_EXTENSIONS:
+        return None
+    source = safe_join(str(UPLOAD_FOLDER), filename)
+    if source is None or not os.path.isfile(source):
+        return None
+    rel_path = f".variants/{width}/{filename.rsplit('.', 1)[0]}.{fmt}"
+    target = UPLOAD_FOLDER / rel_path
+    if target.exists() and target.stat().st_mtime >= os.path.getmtime(source):
+        return rel_path
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_TMP_FOLDER)
+    os.fchmod(fd, PUBLISHED_FILE_MODE)
+    os.close(fd)
+    try:
+        with Image.open(source) as img:
+            img.thumbnail((width, width * 4))
+            if fmt == 'jpeg' and img.mode != 'RGB':
+                img = img.convert('RGBA')
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel('A'))
+                img = background
+            img.save(tmp_path, format=fmt.upper(), quality=IMAGE_VARIANT_QUALITY)
+        os.replace(tmp_path, target)
+    except Exception as e:
+        print(f"Image variant failed for {filename}: {e}")
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return None
+    return rel_path
+
+
+@job_handler('image_variants')
+def image_variants_job(path):
+    for width in IMAGE_VARIANT_WIDTHS:
+        for fmt in ('webp', 'jpeg'):
+            image_variant(path, width, fmt)
+
+
+@app.template_filter('photo_url')
+def photo_url(path, width=None):
+    """URL фото: новые лежат в хранилище (/uploads/...), старые — в static/.
+
+    С width для файлов из хранилища возвращается URL уменьшенной копии.
+    """
+    if not path:
+        return ''
+    if not path.startswith('/'):
+        return f'/static/{path}'
+    if width and path.startswith('/uploads/'):
+        return f'{path}?w={width}'
+    return path
+
+
 def init_db():
     conn = get_db()
     cur = conn.cursor()
+    # Воркеры gunicorn импортируют приложение одновременно: схему создает
+    # и мигрирует один из них, остальные ждут и видят уже примененные версии
+    lock_schema(cur)
     
     # Define table schemas for both databases
     tables = {
@@ -385,58 +1141,549 @@ def init_db():
         }
     }
     
-    # Create all tables
-    for table_name, schemas in tables.items():
-        cur.execute(schemas[DB_TYPE])
-    
-    # Handle migrations for SQLite only
-    if DB_TYPE == 'sqlite':
-        # Add photo column if it doesn't exist
-        try:
-            cur.execute("ALTER TABLE leaders ADD COLUMN photo TEXT")
-        except:
-            pass
-        
-        # Add description column to documents if it doesn't exist
-        try:
-            cur.execute("ALTER TABLE documents ADD COLUMN description TEXT")
-        except:
-            pass
-        
-        # Add claimed_by and claimed_at columns to complaints if they don't exist
-        try:
-            cur.execute("ALTER TABLE complaints ADD COLUMN claimed_by TEXT")
-        except:
-            pass
-        try:
-            cur.execute("ALTER TABLE complaints ADD COLUMN claimed_at TEXT")
-        except:
-            pass
-        
-        # Add columns to job_applications if they don't exist
-        try:
-            cur.execute('ALTER TABLE job_applications ADD COLUMN desired_login TEXT')
-        except:
-            pass
-        try:
-            cur.execute('ALTER TABLE job_applications ADD COLUMN desired_password TEXT')
-        except:
-            pass
+    try:
+        # Create all tables
+        for table_name, schemas in tables.items():
+            cur.execute(schemas[DB_TYPE])
+        apply_migrations(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# ------------------ Schema migrations ------------------
+# Каждая миграция применяется один раз; применённые версии хранятся в
+# schema_migrations. Новые изменения схемы добавляются сюда, а не в init_db.
+# init_db создает таблицы и применяет миграции одной транзакцией под
+# блокировкой схемы: либо всё, либо ничего.
+MIGRATIONS = []
+SCHEMA_LOCK_KEY = 7340155  # произвольный ключ pg_advisory_xact_lock
+SCHEMA_LOCK_TIMEOUT = int(os.getenv('SCHEMA_LOCK_TIMEOUT', 600))
+
+
+def migration(version):
+    def decorator(fn):
+        MIGRATIONS.append((version, fn))
+        return fn
+    return decorator
+
+
+def column_exists(cur, table, column):
+    if DB_TYPE == 'postgresql':
+        cur.execute('SELECT 1 FROM information_schema.columns WHERE table_name=? AND column_name=?', (table, column))
+        return cur.fetchone() is not None
+    cur.execute(f'PRAGMA table_info({table})')
+    return any(r['name'] == column for r in cur.fetchall())
+
+
+def add_column(cur, table, column, ddl):
+    if not column_exists(cur, table, column):
+        cur.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+
+def lock_schema(cur):
+    """Взять блокировку схемы до конца текущей транзакции.
+
+    PostgreSQL — транзакционная advisory-блокировка, SQLite — BEGIN
+    IMMEDIATE (блокировка записи). Ожидание SQLite ограничено
+    SCHEMA_LOCK_TIMEOUT: долгая миграция в соседнем воркере не должна
+    ронять этот по таймауту соединения.
+    """
+    if DB_TYPE == 'postgresql':
+        cur.execute('SELECT pg_advisory_xact_lock(?)', (SCHEMA_LOCK_KEY,))
+        return
+    deadline = time.monotonic() + SCHEMA_LOCK_TIMEOUT
+    while True:
         try:
-            cur.execute('ALTER TABLE job_applications ADD COLUMN status TEXT DEFAULT "pending"')
-        except:
-            pass
+            cur.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or time.monotonic() > deadline:
+                raise
+
+
+def apply_migrations(cur):
+    """Применить недостающие миграции в транзакции, открытой lock_schema"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Версии читаются под блокировкой: то, что успел применить другой
+    # воркер, здесь уже видно
+    cur.execute('SELECT version FROM schema_migrations')
+    applied = {r[0] for r in cur.fetchall()}
+    for version, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        fn(cur)
+        cur.execute('INSERT INTO schema_migrations(version, name) VALUES(?, ?)', (version, fn.__name__))
+
+
+@migration(1)
+def legacy_columns(cur):
+    """Колонки, которые раньше добавлялись через ALTER TABLE ... except: pass"""
+    add_column(cur, 'leaders', 'photo', 'TEXT')
+    add_column(cur, 'documents', 'description', 'TEXT')
+    add_column(cur, 'complaints', 'claimed_by', 'TEXT')
+    add_column(cur, 'complaints', 'claimed_at', 'TEXT')
+    add_column(cur, 'job_applications', 'desired_login', 'TEXT')
+    add_column(cur, 'job_applications', 'desired_password', 'TEXT')
+    add_column(cur, 'job_applications', 'status', "TEXT DEFAULT 'pending'")
+
+
+@migration(2)
+def hot_path_indexes(cur):
+    """Индексы под самые частые фильтры (уведомления, заявки)"""
+    # Лента уведомлений: WHERE recipient_role=? AND recipient_id ... ORDER BY created_at DESC
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_notifications_recipient ON notifications(recipient_role, recipient_id, created_at)')
+    # Счётчик непрочитанных: частичный индекс только по is_read = FALSE
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications(recipient_role, recipient_id) WHERE is_read = FALSE')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_job_applications_status ON job_applications(status)')
+    # user_accounts.username (UNIQUE) и app_settings.key (PRIMARY KEY)
+    # уже проиндексированы самими ограничениями
+
+
+@migration(3)
+def feed_news_search(cur):
+    """Полнотекстовый индекс ленты: FTS5 на SQLite, tsvector + GIN на PostgreSQL"""
+    if DB_TYPE == 'postgresql':
+        cur.execute("""
+            ALTER TABLE feed_news ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+            ) STORED
+        """)
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_feed_news_search ON feed_news USING GIN (search_vector)')
+        return
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS feed_news_fts USING fts5(
+            title, description,
+            content='feed_news', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    # Внешний контент синхронизируется триггерами
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS feed_news_fts_ai AFTER INSERT ON feed_news BEGIN
+            INSERT INTO feed_news_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS feed_news_fts_ad AFTER DELETE ON feed_news BEGIN
+            INSERT INTO feed_news_fts(feed_news_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS feed_news_fts_au AFTER UPDATE ON feed_news BEGIN
+            INSERT INTO feed_news_fts(feed_news_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+            INSERT INTO feed_news_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+        END
+    """)
+    cur.execute("INSERT INTO feed_news_fts(feed_news_fts) VALUES ('rebuild')")
+
+
+@migration(4)
+def stats_counters_table(cur):
+    """Счётчики для /erknm, поддерживаемые обработчиками вместо COUNT(*)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for name in (*STATS_COUNTERS, *SETTINGS_COUNTERS):
+        cur.execute('INSERT INTO stats_counters(name, value) VALUES(?, 0) ON CONFLICT(name) DO NOTHING', (name,))
+    recount_stats(cur)
+
+
+@migration(5)
+def notification_unread_counters(cur):
+    """Счётчики непрочитанных уведомлений по получателю (recipient_id 0 — вся роль)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS notification_unread_counters (
+            recipient_role TEXT NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            unread INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (recipient_role, recipient_id)
+        )
+    """)
+    cur.execute('DELETE FROM notification_unread_counters')
+    cur.execute("""
+        INSERT INTO notification_unread_counters(recipient_role, recipient_id, unread)
+        SELECT recipient_role, COALESCE(recipient_id, 0), COUNT(*)
+        FROM notifications WHERE is_read = FALSE
+        GROUP BY recipient_role, COALESCE(recipient_id, 0)
+    """)
+
+
+@migration(6)
+def uploads_table(cur):
+    """Метаданные файлов в хранилище загрузок"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS uploads (
+            sha256 TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mime TEXT,
+            original_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+
+@migration(7)
+def document_metadata(cur):
+    """Метаданные PDF (страницы, размер, превью, текст) и поисковый индекс документов"""
+    add_column(cur, 'documents', 'pages', 'INTEGER')
+    add_column(cur, 'documents', 'size', 'INTEGER')
+    add_column(cur, 'documents', 'preview', 'TEXT')
+    add_column(cur, 'documents', 'content', 'TEXT')
+    add_column(cur, 'documents', 'ingest_status', 'TEXT')
+    if DB_TYPE == 'postgresql':
+        cur.execute("""
+            ALTER TABLE documents ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('russian', coalesce(description, '')), 'B') ||
+                setweight(to_tsvector('russian', coalesce(content, '')), 'C')
+            ) STORED
+        """)
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_documents_search ON documents USING GIN (search_vector)')
+        return
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            title, description, content,
+            content='documents', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_fts_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_fts(rowid, title, description, content) VALUES (new.id, new.title, new.description, new.content);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_fts_ad AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, title, description, content) VALUES ('delete', old.id, old.title, old.description, old.content);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_fts_au AFTER UPDATE ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, title, description, content) VALUES ('delete', old.id, old.title, old.description, old.content);
+            INSERT INTO documents_fts(rowid, title, description, content) VALUES (new.id, new.title, new.description, new.content);
+        END
+    """)
+    cur.execute("INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')")
+
+
+@migration(8)
+def background_jobs_table(cur):
+    """Очередь фоновых задач (уведомления, обработка картинок и PDF)"""
+    id_column = 'id SERIAL PRIMARY KEY' if DB_TYPE == 'postgresql' else 'id INTEGER PRIMARY KEY AUTOINCREMENT'
+    epoch_type = 'DOUBLE PRECISION' if DB_TYPE == 'postgresql' else 'REAL'
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS background_jobs (
+            {id_column},
+            kind TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after {epoch_type} NOT NULL,
+            locked_at {epoch_type},
+            finished_at {epoch_type},
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_background_jobs_ready ON background_jobs(status, run_after)')
 
-    conn.commit()
-    conn.close()
 
 
+@migration(9)
+def notification_recipients(cur):
+    """Одно сообщение + строки получателей со своим состоянием прочтения.
+
+    Рассылки роли (recipient_id IS NULL) разворачиваются в строки для общей
+    учетной записи роли (recipient_id 0) и каждого пользователя с этой
+    ролью, так что чтение — поиск по ключу (recipient_role, recipient_id)
+    без OR recipient_id IS NULL. Старая таблица notifications больше не
+    пишется.
+    """
+    id_column = 'id SERIAL PRIMARY KEY' if DB_TYPE == 'postgresql' else 'id INTEGER PRIMARY KEY AUTOINCREMENT'
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS notification_messages (
+            {id_column},
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            type TEXT NOT NULL,
+            data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS notification_recipients (
+            recipient_role TEXT NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL REFERENCES notification_messages(id) ON DELETE CASCADE,
+            is_read BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY (recipient_role, recipient_id, message_id)
+        )
+    """)
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_notification_recipients_message ON notification_recipients(message_id)')
+
+    cur.execute("""
+        INSERT INTO notification_messages(id, title, message, type, data, created_at)
+        SELECT id, title, message, type, data, created_at FROM notifications
+    """)
+    if DB_TYPE == 'postgresql':
+        cur.execute("SELECT setval(pg_get_serial_sequence('notification_messages', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM notification_messages")
+    cur.execute("""
+        INSERT INTO notification_recipients(recipient_role, recipient_id, message_id, is_read)
+        SELECT recipient_role, COALESCE(recipient_id, 0), id, COALESCE(is_read, FALSE) FROM notifications
+    """)
+    cur.execute("""
+        INSERT INTO notification_recipients(recipient_role, recipient_id, message_id, is_read)
+        SELECT n.recipient_role, u.id, n.id, COALESCE(n.is_read, FALSE)
+        FROM notifications n JOIN user_accounts u ON u.role = n.recipient_role
+        WHERE n.recipient_id IS NULL
+    """)
+    cur.execute('DELETE FROM notification_unread_counters')
+    cur.execute("""
+        INSERT INTO notification_unread_counters(recipient_role, recipient_id, unread)
+        SELECT recipient_role, recipient_id, COUNT(*)
+        FROM notification_recipients WHERE is_read = FALSE
+        GROUP BY recipient_role, recipient_id
+    """)
+
+
+
+@migration(10)
+def notification_archive_table(cur):
+    """Архив прочитанных уведомлений с истекшим сроком хранения"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS notification_archive (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            type TEXT NOT NULL,
+            data TEXT,
+            recipients TEXT,
+            created_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_notification_messages_type_created ON notification_messages(type, created_at)')
+    # Строки старой таблицы скопированы миграцией 9 и больше не читаются
+    cur.execute('DELETE FROM notifications')
+
+
+@migration(11)
+def row_updated_at(cur):
+    """updated_at — версия строки для ключей кэша фрагментов"""
+    add_column(cur, 'complaints', 'updated_at', 'TIMESTAMP')
+    add_column(cur, 'job_applications', 'updated_at', 'TIMESTAMP')
+
+
+@migration(12)
+def complaint_queue_indexes(cur):
+    """Очередь жалоб: свободные (частичный индекс) и взятые конкретным прокурором"""
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_unclaimed ON complaints(id) WHERE claimed_by IS NULL')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_claimed_by ON complaints(claimed_by, id)')
+
+
+@migration(13)
+def rate_limit_buckets_table(cur):
+    """Общие для воркеров token bucket'ы (RATE_LIMIT_BACKEND=db)"""
+    epoch_type = 'DOUBLE PRECISION' if DB_TYPE == 'postgresql' else 'REAL'
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            bucket TEXT PRIMARY KEY,
+            tokens {epoch_type} NOT NULL,
+            updated_at {epoch_type} NOT NULL
+        )
+    """)
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated ON rate_limit_buckets(updated_at)')
+
+
+@migration(14)
+def drop_archive_recipients(cur):
+    """notification_archive.recipients не заполнялась: получатели истекают раньше сообщения"""
+    if column_exists(cur, 'notification_archive', 'recipients'):
+        cur.execute('ALTER TABLE notification_archive DROP COLUMN recipients')
+
+
+# ------------------ Stats counters ------------------
+# Значения для /erknm хранятся в stats_counters и меняются в той же
+# транзакции, что и сами данные (bump_counter). Периодическая сверка
+# (recount_stats) исправляет возможный дрейф.
+STATS_COUNTERS = {
+    'employees': 'SELECT COUNT(*) FROM employees',
+    'complaints': 'SELECT COUNT(*) FROM complaints',
+    'job_applications': 'SELECT COUNT(*) FROM job_applications',
+    'approved_applications': "SELECT COUNT(*) FROM job_applications WHERE status='approved'",
+    'user_accounts': 'SELECT COUNT(*) FROM user_accounts',
+}
+# Счётчики, которые вводятся в админке и хранятся в app_settings
+SETTINGS_COUNTERS = ('politicians_removed',)
+STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', 3600))
+
+
+def bump_counter(cur, name, delta=1):
+    cur.execute('UPDATE stats_counters SET value = value + ? WHERE name = ?', (delta, name))
+
+
+def set_counter(cur, name, value):
+    cur.execute('UPDATE stats_counters SET value = ? WHERE name = ?', (value, name))
+
+
+def setting_int(cur, key):
+    """Целое значение настройки; пустое или нечисловое — 0"""
+    cur.execute('SELECT value FROM app_settings WHERE key=?', (key,))
+    row = cur.fetchone()
+    try:
+        return int(row[0]) if row and row[0] is not None else 0
+    except ValueError:
+        return 0
+
+
+def recount_stats(cur):
+    """Пересчитать все счётчики по исходным таблицам"""
+    for name, count_sql in STATS_COUNTERS.items():
+        cur.execute(f'UPDATE stats_counters SET value = ({count_sql}) WHERE name = ?', (name,))
+    for name in SETTINGS_COUNTERS:
+        set_counter(cur, name, setting_int(cur, name))
+
+
+def reconcile_stats():
+    conn = get_db()
+    try:
+        recount_stats(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+    page_cache.invalidate('stats')
+
+
+def run_every(interval, fn, name):
+    """Запускать fn раз в interval секунд в фоновом потоке воркера"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                fn()
+            except Exception as e:
+                print(f"Periodic task {name} failed: {e}")
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+if STATS_RECONCILE_INTERVAL > 0:
+    run_every(STATS_RECONCILE_INTERVAL, reconcile_stats, 'stats-reconcile')
+
 init_db()
 
 
 # База данных создается без демо-данных
 
 
+# ------------------ Page cache ------------------
+# Публичные страницы, которые меняются только из админки, кэшируются
+# целиком. Админские обработчики сбрасывают записи по тегам
+# (page_cache.invalidate('documents')); TTL ограничивает устаревание в
+# других воркерах gunicorn, куда инвалидация не доходит.
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 60))
+PAGE_CACHE_MAX_ENTRIES = int(os.getenv('PAGE_CACHE_MAX_ENTRIES', 256))
+
+
+class PageCache:
+    """LRU-кэш отрендеренных страниц с TTL и инвалидацией по тегам"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> dict(expires, tags, body, ...)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, tags, body, mimetype):
+        entry = {
+            'expires': time.monotonic() + self.ttl,
+            'tags': frozenset(tags),
+            'body': body,
+            'mimetype': mimetype,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'last_modified': datetime.now(timezone.utc).replace(microsecond=0),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, *tags):
+        tags = set(tags)
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e['tags'] & tags]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+page_cache = PageCache(PAGE_CACHE_TTL, PAGE_CACHE_MAX_ENTRIES)
+
+
+def cached_page(*tags, bypass_args=()):
+    """Кэшировать GET-страницу для анонимных посетителей.
+
+    Ключ — путь и отсортированные параметры запроса. Ответ отдается с
+    ETag/Last-Modified; совпадающий условный запрос получает 304 без
+    обращения к БД и шаблонам. Запросы с параметрами из bypass_args (и
+    любые запросы с непустой сессией) в кэш не попадают.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if session or any(request.args.get(a) for a in bypass_args):
+                return view(*args, **kwargs)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            entry = page_cache.get(key)
+            if entry is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                entry = page_cache.set(key, tags, response.get_data(), response.mimetype)
+            response = app.response_class(entry['body'], mimetype=entry['mimetype'])
+            response.set_etag(entry['etag'])
+            response.last_modified = entry['last_modified']
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
 def group_news_by_date(items):
     grouped = {}
     for it in items:
@@ -449,74 +1696,558 @@ def group_news_by_date(items):
     return ordered
 
 
+# ------------------ Template cache ------------------
+# Скомпилированные шаблоны сохраняются на диск (байткод Jinja), и новый
+# воркер не компилирует их заново; TEMPLATE_WARMUP загружает все шаблоны
+# при импорте приложения, до того как воркер начнет принимать запросы.
+# {% cache 'имя', id, updated_at %}...{% endcache %} кэширует тяжелые
+# фрагменты (строки жалоб и заявок). Версия строки входит в ключ, поэтому
+# инвалидация не нужна: измененная строка получает новый ключ, а старая
+# запись вытесняется из LRU.
+TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR', str(Path(__file__).with_name('.jinja_cache')))
+TEMPLATE_WARMUP = os.getenv('TEMPLATE_WARMUP', '1') == '1'
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', 2000))
+
+if TEMPLATE_CACHE_DIR:
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+    except OSError as e:
+        print(f'Template bytecode cache disabled: {e}')
+
+
+class LRUCache:
+    """Потокобезопасный LRU с необязательным TTL (фрагменты шаблонов)"""
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = LRUCache(FRAGMENT_CACHE_MAX_ENTRIES)
+
+
+class FragmentCacheExtension(Extension):
+    """Тег {% cache ключ, ... %}: тело рендерится один раз на ключ"""
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        if FRAGMENT_CACHE_MAX_ENTRIES <= 0:
+            return caller()
+        key = tuple(key)
+        body = fragment_cache.get(key)
+        if body is None:
+            # caller() возвращает уже экранированный Markup
+            body = caller()
+            fragment_cache.set(key, body)
+        return body
+
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def warm_templates():
+    """Загрузить все шаблоны: компиляция или чтение байткода с диска"""
+    started = time.perf_counter()
+    names = app.jinja_env.list_templates(extensions=('html',))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names), time.perf_counter() - started
+
+
+@app.cli.command('warm-templates')
+def warm_templates_command():
+    """Скомпилировать шаблоны в TEMPLATE_CACHE_DIR (шаг сборки)"""
+    count, elapsed = warm_templates()
+    click.echo(f'{count} templates loaded in {elapsed * 1000:.0f} ms')
+
+
+# ------------------ News search ------------------
+SEARCH_PER_PAGE = 20
+# Маркеры подсветки: управляющие символы не встречаются в тексте и
+# переживают HTML-экранирование, после которого превращаются в <mark>
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+
+
+def highlight_markup(text):
+    escaped = escape(text or '')
+    return Markup(escaped.replace(HIGHLIGHT_START, Markup('<mark>')).replace(HIGHLIGHT_END, Markup('</mark>')))
+
+
+def fts_match_query(q):
+    """Запрос FTS5: все слова обязательны, каждое как префикс (замена стеммингу)"""
+    words = re.findall(r'\w+', q)
+    return ' '.join(f'"{w}"*' for w in words)
+
+
+def search_feed(cur, q, page, per_page=SEARCH_PER_PAGE):
+    """Найти новости ленты по релевантности.
+
+    Возвращает (rows, has_next); у строк есть title_html и snippet_html
+    с подсвеченными совпадениями.
+    """
+    offset = (page - 1) * per_page
+    if DB_TYPE == 'postgresql':
+        options = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}'
+        cur.execute('''
+            SELECT date, time, title, description, url,
+                   ts_headline('russian', title, query, ?) AS title_hl,
+                   ts_headline('russian', coalesce(description, ''), query, ?) AS snippet
+            FROM feed_news, websearch_to_tsquery('russian', ?) AS query
+            WHERE search_vector @@ query
+            ORDER BY ts_rank(search_vector, query) DESC, id DESC
+            LIMIT ? OFFSET ?
+        ''', (options + ', HighlightAll=true', options + ', MinWords=15, MaxWords=35', q, per_page + 1, offset))
+    else:
+        match = fts_match_query(q)
+        if not match:
+            return [], False
+        # Сначала ранжируются только rowid; highlight/snippet считаются для
+        # строк страницы, а не для всех совпадений
+        cur.execute('''
+            WITH page AS MATERIALIZED (
+                SELECT rowid AS id, bm25(feed_news_fts, 10.0, 1.0) AS rank
+                FROM feed_news_fts WHERE feed_news_fts MATCH ?
+                ORDER BY rank, rowid DESC
+                LIMIT ? OFFSET ?
+            )
+            SELECT f.date, f.time, f.title, f.description, f.url,
+                   highlight(feed_news_fts, 0, ?, ?) AS title_hl,
+                   snippet(feed_news_fts, 1, ?, ?, '…', 24) AS snippet
+            FROM page
+            JOIN feed_news_fts ON feed_news_fts.rowid = page.id
+            JOIN feed_news f ON f.id = page.id
+            WHERE feed_news_fts MATCH ?
+            ORDER BY page.rank, page.id DESC
+        ''', (match, per_page + 1, offset, HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, match))
+    rows = []
+    for r in cur.fetchall():
+        item = dict(r)
+        item['title_html'] = highlight_markup(item.pop('title_hl'))
+        item['snippet_html'] = highlight_markup(item.pop('snippet'))
+        rows.append(item)
+    return rows[:per_page], len(rows) > per_page
+
+
+# ------------------ Keyset pagination ------------------
+# Курсоры в ссылках непрозрачные: base64("<направление>:<id>"). Страница
+# выбирается по индексу первичного ключа (WHERE id < ?), поэтому её цена не
+# зависит от глубины, в отличие от LIMIT/OFFSET.
+FEED_PER_PAGE = 7
+SLIDER_MAX_DOTS = 20
+
+
+def encode_cursor(direction, row_id=''):
+    raw = f'{direction}:{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+LAST_PAGE_CURSOR = encode_cursor('last')
+
+
+def decode_cursor(token):
+    """Вернуть (направление, id); для пустого или битого курсора (None, None)"""
+    if not token:
+        return None, None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        direction, _, row_id = raw.partition(':')
+        if direction == 'last':
+            return direction, None
+        if direction in ('after', 'before', 'at'):
+            return direction, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return None, None
+
+
+def keyset_page(cur, table, columns, token, per_page, where='', params=()):
+    """Страница строк table по убыванию id.
+
+    where/params — дополнительное условие отбора (фильтры очереди).
+    Возвращает (rows, prev_cursor, next_cursor); курсор None, если в эту
+    сторону страниц больше нет.
+    """
+    direction, boundary = decode_cursor(token)
+    select = f'SELECT id, {columns} FROM {table}'
+    scope = f'({where}) AND ' if where else ''
+    everything = f' WHERE {where}' if where else ''
+    if direction == 'after':
+        cur.execute(f'{select} WHERE {scope}id < ? ORDER BY id DESC LIMIT ?', (*params, boundary, per_page + 1))
+    elif direction == 'before':
+        cur.execute(f'{select} WHERE {scope}id > ? ORDER BY id ASC LIMIT ?', (*params, boundary, per_page + 1))
+    elif direction == 'last':
+        cur.execute(f'{select}{everything} ORDER BY id ASC LIMIT ?', (*params, per_page + 1))
+    else:
+        direction = None
+        cur.execute(f'{select}{everything} ORDER BY id DESC LIMIT ?', (*params, per_page + 1))
+    rows = [dict(r) for r in cur.fetchall()]
+    if not rows and direction is not None:
+        # Курсор указывает за пределы таблицы — показываем первую страницу
+        return keyset_page(cur, table, columns, None, per_page, where, params)
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction in ('before', 'last'):
+        rows.reverse()
+    has_prev = {None: False, 'after': True, 'before': more, 'last': more}[direction]
+    has_next = {None: more, 'after': more, 'before': True, 'last': False}[direction]
+    prev_cursor = encode_cursor('before', rows[0]['id']) if has_prev else None
+    next_cursor = encode_cursor('after', rows[-1]['id']) if has_next else None
+    return rows, prev_cursor, next_cursor
+
+
+def slider_state(cur, token):
+    """Текущий слайд и курсоры соседних (с переходом по кругу)"""
+    direction, current_id = decode_cursor(token)
+    if direction == 'at':
+        cur.execute('SELECT id, date, title, description, image FROM slider_news WHERE id <= ? ORDER BY id DESC LIMIT 1', (current_id,))
+    else:
+        cur.execute('SELECT id, date, title, description, image FROM slider_news ORDER BY id DESC LIMIT 1')
+    row = cur.fetchone()
+    if row is None:
+        cur.execute('SELECT id, date, title, description, image FROM slider_news ORDER BY id DESC LIMIT 1')
+        row = cur.fetchone()
+    if row is None:
+        return None, None, None, []
+    current = dict(row)
+
+    cur.execute('SELECT id FROM slider_news WHERE id > ? ORDER BY id ASC LIMIT 1', (current['id'],))
+    newer = cur.fetchone()
+    if newer is None:
+        cur.execute('SELECT id FROM slider_news ORDER BY id ASC LIMIT 1')
+        newer = cur.fetchone()
+    cur.execute('SELECT id FROM slider_news WHERE id < ? ORDER BY id DESC LIMIT 1', (current['id'],))
+    older = cur.fetchone()
+    if older is None:
+        cur.execute('SELECT id FROM slider_news ORDER BY id DESC LIMIT 1')
+        older = cur.fetchone()
+
+    cur.execute('SELECT id FROM slider_news ORDER BY id DESC LIMIT ?', (SLIDER_MAX_DOTS,))
+    dots = [(encode_cursor('at', r[0]), r[0] == current['id']) for r in cur.fetchall()]
+    return current, encode_cursor('at', newer[0]), encode_cursor('at', older[0]), dots
+
+
 @app.route('/')
+@cached_page('slider_news', 'feed_news', bypass_args=('q',))
 def index():
-    page = request.args.get('page', default=1, type=int)
+    page = request.args.get('page', default='', type=str)
     q = request.args.get('q', default='', type=str).strip()
     tab = request.args.get('tab', default='feed', type=str)
     # slider news from DB
     conn = get_db()
     cur = conn.cursor()
-    cur.execute('SELECT COUNT(*) FROM slider_news')
-    total = cur.fetchone()[0]
-    current_news = None
-    if total > 0:
-        if page < 1:
-            page = 1
-        if page > total:
-            page = total
-        offset = page - 1
-        cur.execute('SELECT date, title, description, image FROM slider_news ORDER BY id DESC LIMIT 1 OFFSET ?', (offset,))
-        row = cur.fetchone()
-        if row:
-            current_news = { 'date': row['date'], 'title': row['title'], 'description': row['description'], 'image': row['image'] }
+    current_news, slider_prev, slider_next, slider_dots = slider_state(cur, page)
     # Если активен поиск, не пагинируем ленту, а фильтруем по запросу
     search_results = []
+    search_page = max(1, request.args.get('search_page', default=1, type=int))
+    search_has_next = False
     feed_grouped = []
+    feed_prev = feed_next = None
     if q:
-        like = f"%{q}%"
-        cur.execute('''
-            SELECT date, time, title, description, url
-            FROM feed_news
-            WHERE title LIKE ? OR description LIKE ?
-            ORDER BY id DESC
-            LIMIT 100
-        ''', (like, like))
-        search_results = [dict(r) for r in cur.fetchall()]
-        # сгруппуем найденное по дате для единообразного отображения
-        feed_grouped = group_news_by_date(search_results)
-        feed_page = 1
-        feed_pages = 1
+        # Результаты идут по релевантности, поэтому по датам не группируем
+        search_results, search_has_next = search_feed(cur, q, search_page)
     else:
         # Пагинация ленты (по датам не режем; просто первые N записей)
-        per_page = 7
-        cur.execute('SELECT COUNT(*) FROM feed_news')
-        feed_total = cur.fetchone()[0]
-        feed_page = request.args.get('feed_page', default=1, type=int)
-        if feed_page < 1:
-            feed_page = 1
-        feed_pages = max(1, (feed_total + per_page - 1) // per_page)
-        if feed_page > feed_pages:
-            feed_page = feed_pages
-        start = (feed_page - 1) * per_page
-        cur.execute('SELECT date, time, title, description, url FROM feed_news ORDER BY id DESC LIMIT ? OFFSET ?', (per_page, start))
-        rows = [dict(r) for r in cur.fetchall()]
+        rows, feed_prev, feed_next = keyset_page(
+            cur, 'feed_news', 'date, time, title, description, url',
+            request.args.get('feed_page', default='', type=str), FEED_PER_PAGE,
+        )
         feed_grouped = group_news_by_date(rows)
+        # На первой странице «назад» ведет на последнюю, на последней «вперед» — на первую
+        feed_prev = feed_prev or LAST_PAGE_CURSOR
     conn.close()
 
     return render_template(
         'base.html',
         page=page,
-        total_pages=total,
         news=current_news,
+        slider_prev=slider_prev,
+        slider_next=slider_next,
+        slider_dots=slider_dots,
         feed_groups=feed_grouped,
-        feed_page=feed_page,
-        feed_pages=feed_pages,
+        search_results=search_results,
+        search_page=search_page,
+        search_has_next=search_has_next,
+        feed_prev=feed_prev,
+        feed_next=feed_next,
         q=q,
         tab=('search' if q or tab == 'search' else 'feed'),
     )
 
 
+# ------------------ Rate limiting ------------------
+# POST входа и публичных форм ограничиваются token bucket'ами по паре
+# (форма, IP): емкость — допустимый всплеск, за окно bucket наполняется
+# целиком. Проверка идет в before_request — до разбора формы, запросов к
+# БД и записи файлов. RATE_LIMIT_BACKEND=db добавляет общий для всех
+# воркеров bucket в таблице rate_limit_buckets. Локальный проверяется
+# первым: каждый воркер видит только часть запросов, поэтому если исчерпан
+# локальный bucket, общий исчерпан тем более, и отказ обходится без БД.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # memory | db
+# Сколько доверенных прокси перед приложением дописывают X-Forwarded-For
+# (Railway — 1). По умолчанию 0: заголовок игнорируется, иначе без прокси
+# клиент подставлял бы в него любой адрес и обходил лимиты
+RATE_LIMIT_PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', 0))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv('RATE_LIMIT_MAX_BUCKETS', 10000))
+
+
+def parse_rate_limits(spec):
+    """'login=10/60,jobs=3/3600' -> {'login': (10, 60.0), ...}: всплеск / окно в секундах"""
+    result = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        endpoint, _, limit = item.partition('=')
+        capacity, _, window = limit.partition('/')
+        result[endpoint.strip()] = (int(capacity), float(window))
+    return result
+
+
+RATE_LIMITS = parse_rate_limits(os.getenv('RATE_LIMITS', 'login=10/60,internet_reception=5/600,jobs=3/3600,hotline=5/600'))
+rate_limit_rejections = Counter()
+rate_limit_lock = threading.Lock()
+
+
+class TokenBuckets:
+    """Token bucket'ы в памяти процесса; при переполнении вытесняются давно не использованные"""
+
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, window):
+        """Забрать токен: (разрешено, через сколько секунд появится следующий)"""
+        rate = capacity / window
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+local_buckets = TokenBuckets(RATE_LIMIT_MAX_BUCKETS)
+
+
+def client_ip():
+    """IP клиента: за RATE_LIMIT_PROXY_HOPS прокси — из X-Forwarded-For"""
+    if RATE_LIMIT_PROXY_HOPS:
+        forwarded = [a.strip() for a in request.headers.get('X-Forwarded-For', '').split(',') if a.strip()]
+        if len(forwarded) >= RATE_LIMIT_PROXY_HOPS:
+            return forwarded[-RATE_LIMIT_PROXY_HOPS]
+    return request.remote_addr or 'unknown'
+
+
+def take_shared_token(key, capacity, window):
+    """Общий bucket: один upsert, строка возвращается, только если токен взят"""
+    rate = capacity / window
+    least = 'LEAST' if DB_TYPE == 'postgresql' else 'MIN'
+    refilled = f'{least}(?, rate_limit_buckets.tokens + (excluded.updated_at - rate_limit_buckets.updated_at) * ?)'
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(f'''
+            INSERT INTO rate_limit_buckets(bucket, tokens, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (bucket) DO UPDATE SET tokens = {refilled} - 1, updated_at = excluded.updated_at
+            WHERE {refilled} >= 1
+            RETURNING bucket
+        ''', (key, capacity - 1, time.time(), capacity, rate, capacity, rate))
+        allowed = cur.fetchone() is not None
+        conn.commit()
+        return allowed
+    except Exception as e:
+        # Сбой общего хранилища не должен закрывать формы: остается локальный лимит
+        print(f'Shared rate limit check failed: {e}')
+        conn.rollback()
+        return True
+    finally:
+        conn.close()
+
+
+def rate_limit_retry_after(endpoint):
+    """Секунды до повтора, если запрос нужно отклонить, иначе None"""
+    capacity, window = RATE_LIMITS[endpoint]
+    key = f'{endpoint}:{client_ip()}'
+    allowed, retry_after = local_buckets.take(key, capacity, window)
+    if allowed and RATE_LIMIT_BACKEND == 'db':
+        allowed, retry_after = take_shared_token(key, capacity, window), window / capacity
+    return None if allowed else retry_after
+
+
+@app.before_request
+def enforce_rate_limits():
+    if not RATE_LIMIT_ENABLED or request.method != 'POST' or request.endpoint not in RATE_LIMITS:
+        return None
+    retry_after = rate_limit_retry_after(request.endpoint)
+    if retry_after is None:
+        return None
+    with rate_limit_lock:
+        rate_limit_rejections[request.endpoint] += 1
+    response = app.make_response((render_template(
+        'submitted.html', title='Слишком много запросов',
+        message='Форма отправляется слишком часто. Попробуйте немного позже.',
+    ), 429))
+    response.headers['Retry-After'] = str(int(retry_after) + 1)
+    return response
+
+
+def prune_rate_limit_buckets():
+    """Удалить общие bucket'ы, которые успели наполниться: они равносильны отсутствующим"""
+    horizon = time.time() - max(window for _, window in RATE_LIMITS.values())
+    conn = get_db()
+    try:
+        conn.execute('DELETE FROM rate_limit_buckets WHERE updated_at < ?', (horizon,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if RATE_LIMIT_ENABLED and RATE_LIMIT_BACKEND == 'db' and RATE_LIMITS:
+    run_every(3600, prune_rate_limit_buckets, 'rate-limit-prune')
+
+
+# ------------------ Credentials ------------------
+# Пароли учетных записей хранятся scrypt-хэшами werkzeug
+# ("scrypt:N:r:p$соль$хэш"). Строки, оставшиеся с паролем открытым
+# текстом, и хэши с параметрами, отличными от PASSWORD_HASH_METHOD,
+# перехэшируются при успешном входе; `flask hash-passwords` переводит
+# остальные разом. Стоимость scrypt подбирается benchmarks/kdf_cost.py.
+# Строка учетной записи читается из базы при каждом входе, без кэша:
+# удаление пользователя и смена пароля действуют сразу во всех воркерах.
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:16384:8:1')
+PASSWORD_HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+
+
+def is_password_hash(value):
+    return bool(value) and value.startswith(PASSWORD_HASH_PREFIXES) and value.count('$') == 2
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+
+@lru_cache(maxsize=1)
+def dummy_password_hash():
+    return hash_password(os.urandom(16).hex())
+
+
+def verify_password(stored, password):
+    """Вернуть (пароль верен, stored нужно перехэшировать)"""
+    if not stored:
+        return False, False
+    if not is_password_hash(stored):
+        ok = hmac.compare_digest(stored.encode(), password.encode())
+        return ok, ok
+    ok = check_password_hash(stored, password)
+    return ok, ok and stored.split('$', 1)[0] != PASSWORD_HASH_METHOD
+
+
+def env_credentials_match(username, password, expected_username, expected_password):
+    """Вход по учетке из переменных окружения; пароль там может быть хэшем"""
+    if not hmac.compare_digest(username.encode(), expected_username.encode()):
+        return False
+    if is_password_hash(expected_password):
+        return check_password_hash(expected_password, password)
+    return hmac.compare_digest(password.encode(), expected_password.encode())
+
+
+def find_user(username):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute('SELECT id, username, password, full_name, role FROM user_accounts WHERE username=?', (username,))
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def authenticate_user(username, password):
+    """Учетная запись при верном пароле, иначе None"""
+    user = find_user(username) if username else None
+    if user is None:
+        # Неизвестный логин проверяется так же долго, как известный
+        verify_password(dummy_password_hash(), password)
+        return None
+    ok, needs_rehash = verify_password(user['password'], password)
+    if not ok:
+        return None
+    if needs_rehash:
+        new_hash = hash_password(password)
+        conn = get_db()
+        conn.execute('UPDATE user_accounts SET password=? WHERE id=? AND password=?', (new_hash, user['id'], user['password']))
+        conn.commit()
+        conn.close()
+    return user
+
+
+@app.cli.command('hash-passwords')
+def hash_passwords_command():
+    """Захэшировать пароли, еще хранящиеся открытым текстом"""
+    conn = get_db()
+    cur = conn.cursor()
+    counts = {}
+    for table, column in (('user_accounts', 'password'), ('job_applications', 'desired_password')):
+        cur.execute(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL AND {column} <> ''")
+        plain = [(row['id'], row[column]) for row in cur.fetchall() if not is_password_hash(row[column])]
+        for row_id, value in plain:
+            cur.execute(f'UPDATE {table} SET {column}=? WHERE id=? AND {column}=?', (hash_password(value), row_id, value))
+        conn.commit()
+        counts[table] = len(plain)
+    conn.close()
+    click.echo(', '.join(f'{table}: {count} hashed' for table, count in counts.items()))
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -524,36 +2255,30 @@ def login():
         password = request.form.get('password', '')
         
         # Check admin credentials
-        if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
+        if env_credentials_match(username, password, ADMIN_USERNAME, ADMIN_PASSWORD):
             session['is_admin'] = True
             return redirect(url_for('admin_home'))
         
         # Check prosecutor credentials
-        if username == PROSECUTOR_USERNAME and password == PROSECUTOR_PASSWORD:
+        if env_credentials_match(username, password, PROSECUTOR_USERNAME, PROSECUTOR_PASSWORD):
             session['is_prosecutor'] = True
             session['proc_name'] = 'Прокурор'
             return redirect(url_for('prosecutor_panel'))
         
         # Check user accounts
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute('SELECT id, username, password, full_name, role FROM user_accounts WHERE username=? AND password=?', (username, password))
-        user = cur.fetchone()
-        conn.close()
-        
+        user = authenticate_user(username, password)
         if user:
-            user_id, username, password, full_name, role = user
-            session['user_id'] = user_id
-            session['username'] = username
-            session['full_name'] = full_name
-            session['user_role'] = role
+            session['user_id'] = user['id']
+            session['username'] = user['username']
+            session['full_name'] = user['full_name']
+            session['user_role'] = user['role']
             
-            if role == 'prosecutor':
+            if user['role'] == 'prosecutor':
                 session['is_prosecutor'] = True
-                session['proc_name'] = full_name
+                session['proc_name'] = user['full_name']
                 return redirect(url_for('prosecutor_panel'))
             else:
-                return render_template('submitted.html', title='Вход', message=f'Здравствуйте, {full_name}!')
+                return render_template('submitted.html', title='Вход', message=f"Здравствуйте, {user['full_name']}!")
         
         # обычное сообщение, если не найдено
         if username:
@@ -576,10 +2301,10 @@ def jobs():
                 request.form.get('nick_ds'),
                 request.form.get('nick_roblox'),
                 request.form.get('char_name'),
-                request.form.get('real_age'),
+                request.form.get('real_age', type=int),
                 request.form.get('char_birth'),
                 request.form.get('date_now'),
-                request.form.get('char_age'),
+                request.form.get('char_age', type=int),
                 request.form.get('char_nationality'),
                 request.form.get('char_job'),
                 request.form.get('char_education'),
@@ -593,19 +2318,23 @@ def jobs():
                 request.form.get('term_koap'),
                 request.form.get('term_tk'),
                 desired_login,
-                desired_password,
+                hash_password(desired_password) if desired_password else desired_password,
             ),
         )
-        conn.commit()
-        conn.close()
-        
-        # Создать уведомление для админов о новой заявке
-        create_notification(
+        cur = conn.cursor()
+        bump_counter(cur, 'job_applications')
+        # Уведомление для админов о новой заявке — фоновой задачей
+        enqueue_job(
+            cur, 'notify',
             title="Новая заявка на работу",
             message=f"Поступила заявка от {request.form.get('char_name', 'Неизвестно')}",
             notification_type="job_application",
-            recipient_role="admin"
+            recipient_roles=["admin"],
         )
+        conn.commit()
+        page_cache.invalidate('stats')
+        conn.close()
+        wake_job_workers()
         
         return render_template('submitted.html', title='Заявка отправлена', message='Спасибо! Ваша заявка принята.')
     return render_template('jobs.html')
@@ -613,9 +2342,7 @@ def jobs():
 
 # ------------------ Admin ------------------
 def is_admin() -> bool:
-    is_admin_status = bool(session.get('is_admin'))
-    print(f"DEBUG: is_admin() = {is_admin_status}, session = {dict(session)}")
-    return is_admin_status
+    return bool(session.get('is_admin'))
 
 
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -643,92 +2370,491 @@ def admin_home():
     return redirect(url_for('admin_important'))
 
 
+# Уведомление — одна строка notification_messages и по строке
+# notification_recipients на получателя (recipient_id 0 — общая учетная
+# запись роли из переменных окружения). Рассылка роли доходит до общей
+# учетной записи и до каждого пользователя с этой ролью.
+NOTIFICATION_INSERT_BATCH = 300  # строк на один многострочный INSERT
+
+
+def insert_notification(cur, title, message, notification_type, recipient_roles, recipient_id=None, data=None):
+    """Записать уведомление курсором вызывающего; вернуть события для notify_subscribers.
+
+    recipient_roles — роль или список ролей. С recipient_id уведомление
+    адресно одному получателю, иначе рассылается всем с этими ролями.
+    """
+    if isinstance(recipient_roles, str):
+        recipient_roles = [recipient_roles]
+    cur.execute('''INSERT INTO notification_messages (title, message, type, data)
+                   VALUES (?, ?, ?, ?) RETURNING id''',
+                (title, message, notification_type, data))
+    message_id = cur.fetchone()[0]
+
+    if recipient_id:
+        recipients = [(role, recipient_id) for role in recipient_roles]
+    else:
+        recipients = [(role, 0) for role in recipient_roles]
+        placeholders = ', '.join('?' * len(recipient_roles))
+        cur.execute(f'SELECT role, id FROM user_accounts WHERE role IN ({placeholders})', recipient_roles)
+        recipients += [(r[0], r[1]) for r in cur.fetchall()]
+
+    for start in range(0, len(recipients), NOTIFICATION_INSERT_BATCH):
+        batch = recipients[start:start + NOTIFICATION_INSERT_BATCH]
+        rows = ', '.join(['(?, ?, ?)'] * len(batch))
+        cur.execute(f'INSERT INTO notification_recipients (recipient_role, recipient_id, message_id) VALUES {rows}',
+                    [v for role, rid in batch for v in (role, rid, message_id)])
+        cur.execute(f'''INSERT INTO notification_unread_counters (recipient_role, recipient_id, unread)
+                        VALUES {rows}
+                        ON CONFLICT (recipient_role, recipient_id)
+                        DO UPDATE SET unread = notification_unread_counters.unread + excluded.unread''',
+                    [v for role, rid in batch for v in (role, rid, 1)])
+
+    return [{
+        'event': 'notification',
+        'id': message_id,
+        'title': title,
+        'message': message,
+        'type': notification_type,
+        'recipient_role': role,
+        'recipient_id': recipient_id,
+    } for role in recipient_roles]
+
+
 def create_notification(title, message, notification_type, recipient_role, recipient_id=None, data=None):
-    """Создать новое уведомление"""
+    """Создать новое уведомление (recipient_role — роль или список ролей)"""
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute('''INSERT INTO notifications (title, message, type, recipient_role, recipient_id, data) 
-                   VALUES (?, ?, ?, ?, ?, ?)''', 
-                (title, message, notification_type, recipient_role, recipient_id, data))
-    conn.commit()
-    conn.close()
+    try:
+        events = insert_notification(conn.cursor(), title, message, notification_type, recipient_role, recipient_id, data)
+        conn.commit()
+        # Уведомление уже сохранено: сбой публикации не должен ни ронять
+        # запрос, ни вызывать повтор задачи notify (он бы его продублировал).
+        # Клиенты без события увидят уведомление при опросе счётчика.
+        for event in events:
+            try:
+                notify_subscribers(conn, event)
+            except Exception as e:
+                conn.rollback()
+                print(f"Notification publish failed: {e}")
+    finally:
+        conn.close()
+
+
+@job_handler('notify')
+def notify_job(title, message, notification_type, recipient_roles, recipient_id=None, data=None):
+    """Уведомление нескольким ролям одной транзакцией; после ее коммита задача
+    не падает (ошибки публикации только пишутся в лог), так что повтора нет"""
+    create_notification(title, message, notification_type, recipient_roles, recipient_id, data)
 
 def get_notifications(recipient_role, recipient_id=None, limit=50):
     """Получить уведомления для пользователя"""
     conn = get_db()
     cur = conn.cursor()
-    
-    if recipient_id:
-        cur.execute('''SELECT id, title, message, type, is_read, created_at, data 
-                       FROM notifications 
-                       WHERE recipient_role = ? AND (recipient_id = ? OR recipient_id IS NULL)
-                       ORDER BY created_at DESC LIMIT ?''', 
-                    (recipient_role, recipient_id, limit))
-    else:
-        cur.execute('''SELECT id, title, message, type, is_read, created_at, data 
-                       FROM notifications 
-                       WHERE recipient_role = ? AND recipient_id IS NULL
-                       ORDER BY created_at DESC LIMIT ?''', 
-                    (recipient_role, limit))
-    
+    cur.execute('''SELECT m.id, m.title, m.message, m.type, r.is_read, m.created_at, m.data
+                   FROM notification_recipients r
+                   JOIN notification_messages m ON m.id = r.message_id
+                   WHERE r.recipient_role = ? AND r.recipient_id = ?
+                   ORDER BY r.message_id DESC LIMIT ?''',
+                (recipient_role, recipient_id or 0, limit))
     notifications = [dict(r) for r in cur.fetchall()]
     conn.close()
     return notifications
 
-def mark_notification_read(notification_id):
-    """Отметить уведомление как прочитанное"""
+def bump_unread(cur, recipient_role, recipient_id, delta):
+    """Изменить счётчик непрочитанных (в транзакции вызывающего)"""
+    cur.execute('''INSERT INTO notification_unread_counters (recipient_role, recipient_id, unread)
+                   VALUES (?, ?, ?)
+                   ON CONFLICT (recipient_role, recipient_id)
+                   DO UPDATE SET unread = notification_unread_counters.unread + excluded.unread''',
+                (recipient_role, recipient_id or 0, delta))
+
+def mark_notification_read(notification_id, recipient_role, recipient_id=None):
+    """Отметить уведомление прочитанным для получателя"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute('''UPDATE notification_recipients SET is_read = TRUE
+                   WHERE recipient_role = ? AND recipient_id = ? AND message_id = ? AND is_read = FALSE''',
+                (recipient_role, recipient_id or 0, notification_id))
+    if cur.rowcount:
+        bump_unread(cur, recipient_role, recipient_id, -1)
+    conn.commit()
+    conn.close()
+
+def mark_all_notifications_read(recipient_role, recipient_id=None):
+    """Отметить прочитанными все уведомления получателя"""
     conn = get_db()
     cur = conn.cursor()
-    cur.execute('UPDATE notifications SET is_read = TRUE WHERE id = ?', (notification_id,))
+    cur.execute('''UPDATE notification_recipients SET is_read = TRUE
+                   WHERE recipient_role = ? AND recipient_id = ? AND is_read = FALSE''',
+                (recipient_role, recipient_id or 0))
+    # Вычитаем ровно отмеченные строки: уведомление, пришедшее после UPDATE,
+    # остается непрочитанным и в счётчике
+    if cur.rowcount:
+        bump_unread(cur, recipient_role, recipient_id, -cur.rowcount)
     conn.commit()
     conn.close()
 
 def get_unread_count(recipient_role, recipient_id=None):
-    """Получить количество непрочитанных уведомлений"""
+    """Получить количество непрочитанных уведомлений (из счётчиков, без COUNT)"""
     conn = get_db()
     cur = conn.cursor()
-    
-    if recipient_id:
-        cur.execute('''SELECT COUNT(*) FROM notifications 
-                       WHERE recipient_role = ? AND (recipient_id = ? OR recipient_id IS NULL) 
-                       AND is_read = FALSE''', 
-                    (recipient_role, recipient_id))
-    else:
-        cur.execute('''SELECT COUNT(*) FROM notifications 
-                       WHERE recipient_role = ? AND recipient_id IS NULL 
-                       AND is_read = FALSE''', 
-                    (recipient_role,))
-    
-    count = cur.fetchone()[0]
+    cur.execute('''SELECT unread FROM notification_unread_counters
+                   WHERE recipient_role = ? AND recipient_id = ?''',
+                (recipient_role, recipient_id or 0))
+    row = cur.fetchone()
     conn.close()
-    return count
+    return row[0] if row else 0
+
+# ------------------ Notification retention ------------------
+# Чистка идет в два шага, пачками по NOTIFICATION_ARCHIVE_BATCH, каждая в
+# своей короткой транзакции:
+# 1. строки получателей удаляются по одной: прочитанные — после срока
+#    хранения типа, непрочитанные — после NOTIFICATION_UNREAD_MAX_DAYS
+#    (рассылка на роль достается и неактивным учеткам, которые ее никогда
+#    не прочтут);
+# 2. сообщения старше срока, у которых не осталось получателей, переносятся
+#    в notification_archive (или, с NOTIFICATION_ARCHIVE_DIR, в файлы
+#    notifications-YYYY-MM.jsonl.gz). Архивируется только текст сообщения:
+#    кто его получал и прочитал, к этому моменту уже не хранится.
+# Запускается раз в NOTIFICATION_RETENTION_INTERVAL; из нескольких
+# воркеров запуск достается одному (аренда в app_settings). Так же раз в
+# NOTIFICATION_RECOUNT_INTERVAL счётчики непрочитанных сверяются с
+# notification_recipients.
+NOTIFICATION_RETENTION_DAYS = int(os.getenv('NOTIFICATION_RETENTION_DAYS', 90))
+NOTIFICATION_UNREAD_MAX_DAYS = int(os.getenv('NOTIFICATION_UNREAD_MAX_DAYS', 365))
+NOTIFICATION_RETENTION_INTERVAL = int(os.getenv('NOTIFICATION_RETENTION_INTERVAL', 86400))
+NOTIFICATION_RECOUNT_INTERVAL = int(os.getenv('NOTIFICATION_RECOUNT_INTERVAL', 3600))
+NOTIFICATION_ARCHIVE_BATCH = int(os.getenv('NOTIFICATION_ARCHIVE_BATCH', 500))
+NOTIFICATION_ARCHIVE_DIR = os.getenv('NOTIFICATION_ARCHIVE_DIR')
+NOTIFICATION_ARCHIVE_PAUSE = 0.05  # пауза между пачками, чтобы не держать запись
+
+
+def parse_retention(spec):
+    """'complaint=180,job_application=60' -> {'complaint': 180, ...}; 0 — хранить всегда"""
+    result = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, days = item.partition('=')
+        result[name.strip()] = int(days)
+    return result
+
+
+NOTIFICATION_RETENTION_BY_TYPE = parse_retention(os.getenv('NOTIFICATION_RETENTION_BY_TYPE', ''))
+retention_stats = {'runs': 0, 'archived_total': 0, 'recipients_removed_total': 0, 'last_run_at': None,
+                   'last_archived': 0, 'last_recipients_removed': 0, 'last_duration': None}
+retention_stats_lock = threading.Lock()
+
+
+def claim_maintenance(name, interval):
+    """Атомарно забрать периодическую задачу; False, если ее недавно выполнил другой воркер"""
+    key = f'maintenance:{name}'
+    now = time.time()
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO app_settings(key, value) VALUES(?, '0') ON CONFLICT(key) DO NOTHING", (key,))
+        # DOUBLE PRECISION: REAL в PostgreSQL — float4, он округляет epoch до ~64 с
+        cur.execute('UPDATE app_settings SET value = ? WHERE key = ? AND CAST(value AS DOUBLE PRECISION) <= ?',
+                    (str(now), key, now - interval * 0.9))
+        claimed = cur.rowcount == 1
+        conn.commit()
+        return claimed
+    finally:
+        conn.close()
+
+
+def write_archive_file(rows):
+    os.makedirs(NOTIFICATION_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(NOTIFICATION_ARCHIVE_DIR, f"notifications-{datetime.now(timezone.utc):%Y-%m}.jsonl.gz")
+    # Каждая пачка — отдельный gzip-член; zcat/gzip.open читают файл целиком
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def days_ago(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def expire_recipient_batch(cur, notification_type, read_cutoff, unread_cutoff):
+    """Удалить одну пачку строк получателей; вернуть их число"""
+    expired = 'r.is_read = TRUE AND m.created_at < ?'
+    params = [notification_type, read_cutoff]
+    if unread_cutoff:
+        expired = f'({expired}) OR m.created_at < ?'
+        params.append(unread_cutoff)
+    cur.execute(f'''SELECT r.recipient_role, r.recipient_id, r.message_id, r.is_read
+                    FROM notification_recipients r JOIN notification_messages m ON m.id = r.message_id
+                    WHERE m.type = ? AND ({expired})
+                    LIMIT ?''', (*params, NOTIFICATION_ARCHIVE_BATCH))
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+    keys = ', '.join(['(?, ?, ?)'] * len(rows))
+    cur.execute(f'DELETE FROM notification_recipients WHERE (recipient_role, recipient_id, message_id) IN (VALUES {keys})',
+                [v for r in rows for v in (r['recipient_role'], r['recipient_id'], r['message_id'])])
+    unread = Counter((r['recipient_role'], r['recipient_id']) for r in rows if not r['is_read'])
+    if unread:
+        cur.executemany('UPDATE notification_unread_counters SET unread = unread - ? WHERE recipient_role = ? AND recipient_id = ?',
+                        [(n, role, rid) for (role, rid), n in unread.items()])
+    return len(rows)
+
+
+def archive_notification_batch(cur, notification_type, cutoff):
+    """Перенести одну пачку сообщений без получателей; вернуть их число"""
+    cur.execute('''SELECT id, title, message, type, data, created_at FROM notification_messages m
+                   WHERE m.type = ? AND m.created_at < ?
+                   AND NOT EXISTS (SELECT 1 FROM notification_recipients r WHERE r.message_id = m.id)
+                   ORDER BY m.id LIMIT ?''', (notification_type, cutoff, NOTIFICATION_ARCHIVE_BATCH))
+    rows = [dict(r) for r in cur.fetchall()]
+    if not rows:
+        return 0
+    ids = [r['id'] for r in rows]
+    placeholders = ', '.join('?' * len(ids))
+    if NOTIFICATION_ARCHIVE_DIR:
+        write_archive_file(rows)
+    else:
+        values = ', '.join(['(?, ?, ?, ?, ?, ?)'] * len(rows))
+        cur.execute(f'''INSERT INTO notification_archive(id, title, message, type, data, created_at)
+                        VALUES {values} ON CONFLICT(id) DO NOTHING''',
+                    [v for r in rows for v in (r['id'], r['title'], r['message'], r['type'], r['data'], r['created_at'])])
+    cur.execute(f'DELETE FROM notification_messages WHERE id IN ({placeholders})', ids)
+    return len(rows)
+
+
+def run_in_batches(conn, step):
+    """Повторять step() с коммитом после каждой пачки, пока пачки полные"""
+    total = 0
+    while True:
+        done = step()
+        conn.commit()
+        total += done
+        if done < NOTIFICATION_ARCHIVE_BATCH:
+            return total
+        time.sleep(NOTIFICATION_ARCHIVE_PAUSE)
+
+
+def archive_notifications(force=False):
+    """Удалить получателей с истекшим сроком и перенести в архив сообщения; вернуть число сообщений"""
+    if not force and not claim_maintenance('notification-retention', NOTIFICATION_RETENTION_INTERVAL):
+        return 0
+    started = time.monotonic()
+    archived = removed = 0
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT DISTINCT type FROM notification_messages')
+        types = [r[0] for r in cur.fetchall()]
+        for notification_type in types:
+            days = NOTIFICATION_RETENTION_BY_TYPE.get(notification_type, NOTIFICATION_RETENTION_DAYS)
+            if days <= 0:
+                continue
+            cutoff = days_ago(days)
+            unread_cutoff = days_ago(max(days, NOTIFICATION_UNREAD_MAX_DAYS)) if NOTIFICATION_UNREAD_MAX_DAYS > 0 else None
+            removed += run_in_batches(conn, lambda: expire_recipient_batch(cur, notification_type, cutoff, unread_cutoff))
+            archived += run_in_batches(conn, lambda: archive_notification_batch(cur, notification_type, cutoff))
+        if (archived or removed) and DB_TYPE == 'sqlite':
+            # Обновить статистику планировщика после массового удаления
+            cur.execute('PRAGMA optimize')
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    with retention_stats_lock:
+        retention_stats['runs'] += 1
+        retention_stats['archived_total'] += archived
+        retention_stats['recipients_removed_total'] += removed
+        retention_stats['last_run_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        retention_stats['last_archived'] = archived
+        retention_stats['last_recipients_removed'] = removed
+        retention_stats['last_duration'] = round(time.monotonic() - started, 3)
+    if archived or removed:
+        print(f"Notification retention: removed {removed} recipient rows, archived {archived} notifications")
+    return archived
+
+
+if NOTIFICATION_RETENTION_INTERVAL > 0:
+    run_every(NOTIFICATION_RETENTION_INTERVAL, archive_notifications, 'notification-retention')
+
+
+def recount_unread(cur):
+    """Сверить счётчики непрочитанных с notification_recipients; вернуть число исправленных"""
+    if DB_TYPE == 'postgresql':
+        # Дождаться транзакций, уже менявших счётчики, и задержать новые до
+        # коммита: их +1/-1 не потеряются между подсчетом и записью
+        cur.execute('LOCK TABLE notification_unread_counters IN SHARE ROW EXCLUSIVE MODE')
+    actual = '''(SELECT COUNT(*) FROM notification_recipients r
+                 WHERE r.recipient_role = notification_unread_counters.recipient_role
+                 AND r.recipient_id = notification_unread_counters.recipient_id AND r.is_read = FALSE)'''
+    cur.execute(f'UPDATE notification_unread_counters SET unread = {actual} WHERE unread <> {actual}')
+    fixed = cur.rowcount
+    cur.execute('''INSERT INTO notification_unread_counters(recipient_role, recipient_id, unread)
+                   SELECT recipient_role, recipient_id, COUNT(*) FROM notification_recipients
+                   WHERE is_read = FALSE GROUP BY recipient_role, recipient_id
+                   ON CONFLICT (recipient_role, recipient_id) DO NOTHING''')
+    return fixed + cur.rowcount
+
+
+def reconcile_unread_counters(force=False):
+    if not force and not claim_maintenance('unread-recount', NOTIFICATION_RECOUNT_INTERVAL):
+        return 0
+    conn = get_db()
+    try:
+        fixed = recount_unread(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+    if fixed:
+        print(f"Unread counters: fixed {fixed} drifted rows")
+    return fixed
+
+
+if NOTIFICATION_RECOUNT_INTERVAL > 0:
+    run_every(NOTIFICATION_RECOUNT_INTERVAL, reconcile_unread_counters, 'unread-recount')
 
-def admin_fetch_lists():
+
+@app.cli.command('notifications-retention')
+@click.option('--vacuum', is_flag=True, help='После архивации сжать файл базы (только SQLite, блокирует запись)')
+def notifications_retention_command(vacuum):
+    """Архивировать уведомления с истекшим сроком хранения"""
+    print(f'Archived {archive_notifications(force=True)} notifications')
+    if vacuum and DB_TYPE == 'sqlite':
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute('VACUUM')
+        conn.close()
+
+
+# ------------------ Notification push (SSE) ------------------
+# create_notification публикует событие во внутрипроцессный брокер, откуда
+# его получают открытые потоки /notifications/stream. На PostgreSQL события
+# идут через LISTEN/NOTIFY, чтобы их видели подписчики во всех воркерах.
+# Поток держит воркер (или поток gthread) на всё время соединения, поэтому
+# SSE включается явно; без него страницы опрашивают счётчик с ETag.
+NOTIFICATIONS_SSE = os.getenv('NOTIFICATIONS_SSE', '0') == '1'
+NOTIFICATIONS_PG_BRIDGE = DB_TYPE == 'postgresql' and os.getenv('NOTIFICATIONS_PG_BRIDGE', '1') == '1'
+NOTIFICATIONS_CHANNEL = 'app_notifications'
+SSE_HEARTBEAT = int(os.getenv('SSE_HEARTBEAT', 20))
+SSE_MAX_DURATION = int(os.getenv('SSE_MAX_DURATION', 300))
+
+
+class NotificationBroker:
+    """Внутрипроцессный pub/sub для SSE-подписчиков"""
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = {}  # queue -> (role, recipient_id)
+        self._lock = threading.Lock()
+
+    def subscribe(self, role, recipient_id):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers[q] = (role, recipient_id)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+    def publish(self, event):
+        with self._lock:
+            targets = [
+                q for q, (role, recipient_id) in self._subscribers.items()
+                if role == event.get('recipient_role')
+                and (event.get('recipient_id') is None or event.get('recipient_id') == recipient_id)
+            ]
+        for q in targets:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass  # медленный клиент пропустит событие, счётчик придет со следующим
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+notification_broker = NotificationBroker()
+
+
+def notify_subscribers(conn, event):
+    """Разослать событие подписчикам; вызывать после commit"""
+    if NOTIFICATIONS_PG_BRIDGE:
+        conn.execute('SELECT pg_notify(?, ?)', (NOTIFICATIONS_CHANNEL, json.dumps(event, ensure_ascii=False)[:7900]))
+        conn.commit()
+    else:
+        notification_broker.publish(event)
+
+
+def listen_pg_notifications():
+    """LISTEN app_notifications и пересылка событий в локальный брокер"""
+    while True:
+        try:
+            listener = psycopg2.connect(DATABASE_URL)
+            listener.autocommit = True
+            listener.cursor().execute(f'LISTEN {NOTIFICATIONS_CHANNEL}')
+            while True:
+                if select.select([listener], [], [], SSE_HEARTBEAT) == ([], [], []):
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    note = listener.notifies.pop(0)
+                    try:
+                        notification_broker.publish(json.loads(note.payload))
+                    except ValueError:
+                        pass
+        except Exception as e:
+            print(f"Notification listener error: {e}")
+            time.sleep(5)
+
+
+if NOTIFICATIONS_SSE and NOTIFICATIONS_PG_BRIDGE:
+    threading.Thread(target=listen_pg_notifications, name='pg-listen', daemon=True).start()
+
+
+def notification_recipient():
+    """(recipient_role, recipient_id) текущей сессии или None"""
+    if is_admin():
+        return 'admin', None
+    if session.get('user_id'):
+        return session.get('user_role'), session.get('user_id')
+    if is_prosecutor():
+        return 'prosecutor', None
+    return None
+
+
+def sse_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n'
+
+
+# ------------------ Admin sections ------------------
+# Каждая страница админки загружает только свой раздел: одну страницу
+# строк (keyset по id) и только те колонки, которые выводит шаблон.
+# Длинные тексты обрезаются на стороне БД на символ длиннее, чем
+# показывает шаблон, чтобы проверка «...» в шаблоне продолжала работать.
+ADMIN_PER_PAGE = int(os.getenv('ADMIN_PER_PAGE', 50))
+ADMIN_SECTIONS = {
+    'slider_news': ('slider_news', 'date, title, substr(description, 1, 101) AS description, image'),
+    'feed': ('feed_news', 'date, time, title, substr(description, 1, 51) AS description, url'),
+    'employees': ('employees', 'name, position, contact'),
+    'documents': ('documents', 'date, title, description, url, pages, ingest_status'),
+    'leaders': ('leaders', 'date, name, substr(message, 1, 101) AS message, photo'),
+    'job_apps': ('job_applications', 'created_at, char_name, char_age, char_nationality, char_job, nick_ds, desired_login, status, updated_at'),
+}
+
+
+def admin_load_section(name, per_page=ADMIN_PER_PAGE):
+    """Страница раздела админки по курсору из ?cursor=.
+
+    Возвращает (rows, pager), где pager — курсоры соседних страниц для
+    шаблона admin/_pager.html.
+    """
+    table, columns = ADMIN_SECTIONS[name]
     conn = get_db()
     cur = conn.cursor()
-    cur.execute('SELECT date, title, description, image FROM slider_news ORDER BY id DESC LIMIT 50')
-    slider = [dict(r) for r in cur.fetchall()]
-    cur.execute('SELECT date, time, title, description, url FROM feed_news ORDER BY id DESC LIMIT 50')
-    feed = [dict(r) for r in cur.fetchall()]
-    cur.execute('SELECT id, name, position, contact FROM employees ORDER BY id DESC LIMIT 200')
-    employees = [dict(r) for r in cur.fetchall()]
-    cur.execute('SELECT date, title, description, url FROM documents ORDER BY id DESC LIMIT 200')
-    documents = [dict(r) for r in cur.fetchall()]
-    cur.execute('SELECT id, date, name, message, photo FROM leaders ORDER BY id DESC LIMIT 50')
-    leaders = [dict(r) for r in cur.fetchall()]
-    cur.execute('SELECT id, created_at, char_name, char_age, char_nationality, char_job, nick_ds, desired_login, status FROM job_applications ORDER BY id DESC LIMIT 200')
-    job_apps = [dict(r) for r in cur.fetchall()]
-    cur.execute('SELECT id, created_at, fio, nick_ds, violator_ds, violator_roblox, details, image, claimed_by, claimed_at FROM complaints ORDER BY id DESC LIMIT 200')
-    complaints = [dict(r) for r in cur.fetchall()]
+    rows, prev_cursor, next_cursor = keyset_page(cur, table, columns, request.args.get('cursor', ''), per_page)
     conn.close()
-    return slider, feed, employees, documents, leaders, job_apps, complaints
-
-def admin_fetch_with_notifications():
-    """Получить данные для админки с уведомлениями"""
-    slider, feed, employees, documents, leaders, job_apps, complaints = admin_fetch_lists()
-    notifications = get_notifications('admin')
-    unread_count = get_unread_count('admin')
-    return slider, feed, employees, documents, leaders, job_apps, complaints, notifications, unread_count
+    return rows, {'prev': prev_cursor, 'next': next_cursor}
 
 
 @app.route('/admin/organs')
@@ -754,6 +2880,7 @@ def admin_add_organ():
         (request.form.get('url','').strip() or None),
     ))
     conn.commit()
+    page_cache.invalidate('organs')
     conn.close()
     return redirect(url_for('admin_organs'))
 
@@ -765,6 +2892,7 @@ def admin_delete_organ(item_id: int):
     conn = get_db()
     conn.execute('DELETE FROM organs_units WHERE id=?', (item_id,))
     conn.commit()
+    page_cache.invalidate('organs')
     conn.close()
     return redirect(url_for('admin_organs'))
 
@@ -773,53 +2901,55 @@ def admin_delete_organ(item_id: int):
 def admin_important():
     if not is_admin():
         return redirect(url_for('admin_login'))
-    slider, feed, employees, documents, leaders, job_apps, complaints = admin_fetch_lists()
+    slider, pager = admin_load_section('slider_news')
     unread_count = get_unread_count('admin')
-    return render_template('admin/important.html', slider_news=slider, unread_count=unread_count)
+    return render_template('admin/important.html', slider_news=slider, unread_count=unread_count, pager=pager)
 
 
 @app.route('/admin/ordinary')
 def admin_ordinary():
     if not is_admin():
         return redirect(url_for('admin_login'))
-    slider, feed, employees, documents, leaders, job_apps, complaints = admin_fetch_lists()
+    feed, pager = admin_load_section('feed')
     unread_count = get_unread_count('admin')
-    return render_template('admin/ordinary.html', feed=feed, unread_count=unread_count)
+    return render_template('admin/ordinary.html', feed=feed, unread_count=unread_count, pager=pager)
 
 
 @app.route('/admin/employees')
 def admin_employees():
     if not is_admin():
         return redirect(url_for('admin_login'))
-    slider, feed, employees, documents, leaders, job_apps, complaints = admin_fetch_lists()
+    employees, pager = admin_load_section('employees')
     unread_count = get_unread_count('admin')
-    return render_template('admin/employees.html', employees=employees, unread_count=unread_count)
+    return render_template('admin/employees.html', employees=employees, unread_count=unread_count, pager=pager)
 
 
 @app.route('/admin/jobs')
 def admin_jobs():
     if not is_admin():
         return redirect(url_for('admin_login'))
-    slider, feed, employees, documents, leaders, job_apps, complaints = admin_fetch_lists()
+    job_apps, pager = admin_load_section('job_apps')
     unread_count = get_unread_count('admin')
-    return render_template('admin/jobs.html', job_apps=job_apps, unread_count=unread_count)
+    return render_template('admin/jobs.html', job_apps=job_apps, unread_count=unread_count, pager=pager)
 
 
 @app.route('/admin/docs')
 def admin_docs():
     if not is_admin():
         return redirect(url_for('admin_login'))
-    slider, feed, employees, documents, leaders, job_apps, complaints = admin_fetch_lists()
+    documents, pager = admin_load_section('documents')
     unread_count = get_unread_count('admin')
-    return render_template('admin/documents.html', documents=documents, unread_count=unread_count)
+    return render_template('admin/documents.html', documents=documents, unread_count=unread_count, pager=pager)
 
 
 @app.route('/admin/leader')
 def admin_leader():
     if not is_admin():
         return redirect(url_for('admin_login'))
-    slider, feed, employees, documents, leaders, job_apps, complaints, notifications, unread_count = admin_fetch_with_notifications()
-    return render_template('admin/leader.html', leaders=leaders, notifications=notifications, unread_count=unread_count)
+    leaders, pager = admin_load_section('leaders')
+    notifications = get_notifications('admin')
+    unread_count = get_unread_count('admin')
+    return render_template('admin/leader.html', leaders=leaders, notifications=notifications, unread_count=unread_count, pager=pager)
 
 
 @app.route('/admin/complaints')
@@ -828,7 +2958,7 @@ def admin_complaints():
         return redirect(url_for('admin_login'))
     conn = get_db()
     cur = conn.cursor()
-    cur.execute('SELECT id, created_at, fio, nick_ds, violator_ds, violator_roblox, details, image, claimed_by, claimed_at FROM complaints ORDER BY id DESC LIMIT 300')
+    cur.execute('SELECT id, created_at, fio, nick_ds, violator_ds, violator_roblox, details, image, claimed_by, claimed_at, updated_at FROM complaints ORDER BY id DESC LIMIT 300')
     complaints = [dict(r) for r in cur.fetchall()]
     conn.close()
     unread_count = get_unread_count('admin')
@@ -853,22 +2983,9 @@ def admin_add_slider_news():
     if not is_admin():
         return redirect(url_for('admin_login'))
     
-    # Обработка загрузки файла
-    image_path = '/logo/logo.png'  # По умолчанию
-    if 'image' in request.files:
-        file = request.files['image']
-        if file and file.filename and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # Добавляем timestamp для уникальности
-            import time
-            timestamp = str(int(time.time()))
-            name, ext = os.path.splitext(filename)
-            filename = f"{name}_{timestamp}{ext}"
-            filepath = UPLOAD_FOLDER / filename
-            file.save(filepath)
-            image_path = f'/uploads/{filename}'
-    
     conn = get_db()
+    # Обработка загрузки файла
+    image_path = store_upload(conn.cursor(), request.files.get('image')) or '/logo/logo.png'  # По умолчанию логотип
     conn.execute(
         'INSERT INTO slider_news(date, title, description, image) VALUES(?,?,?,?)',
         (
@@ -879,6 +2996,7 @@ def admin_add_slider_news():
         ),
     )
     conn.commit()
+    page_cache.invalidate('slider_news')
     conn.close()
     return redirect(url_for('admin_important'))
 
@@ -899,6 +3017,7 @@ def admin_add_feed_news():
         ),
     )
     conn.commit()
+    page_cache.invalidate('feed_news')
     conn.close()
     return redirect(url_for('admin_ordinary'))
 
@@ -911,7 +3030,9 @@ def admin_add_employee():
     conn.execute('INSERT INTO employees(name, position, contact) VALUES(?,?,?)', (
         request.form.get('name','').strip(), request.form.get('position','').strip(), request.form.get('contact','').strip()
     ))
+    bump_counter(conn.cursor(), 'employees')
     conn.commit()
+    page_cache.invalidate('stats')
     conn.close()
     flash('Сотрудник добавлен', 'success')
     return redirect(url_for('admin_employees'))
@@ -966,7 +3087,9 @@ def admin_delete_employee(emp_id: int):
     if employee:
         # Delete employee
         cur.execute('DELETE FROM employees WHERE id=?', (emp_id,))
+        bump_counter(cur, 'employees', -1)
         conn.commit()
+        page_cache.invalidate('stats')
         flash(f'Сотрудник {employee[0]} удален', 'success')
     else:
         flash('Сотрудник не найден', 'error')
@@ -980,11 +3103,15 @@ def admin_add_document():
     if not is_admin():
         return redirect(url_for('admin_login'))
     conn = get_db()
-    conn.execute('INSERT INTO documents(date, title, url) VALUES(?,?,?)', (
+    cur = conn.cursor()
+    cur.execute("INSERT INTO documents(date, title, url, ingest_status) VALUES(?,?,?,'pending') RETURNING id", (
         request.form.get('date'), request.form.get('title','').strip(), request.form.get('url','').strip()
     ))
+    enqueue_job(cur, 'document_ingest', doc_id=cur.fetchone()[0])
     conn.commit()
+    page_cache.invalidate('documents')
     conn.close()
+    wake_job_workers()
     return redirect(url_for('admin_docs'))
 
 
@@ -997,26 +3124,7 @@ def admin_add_leader():
     cur = conn.cursor()
     
     # Handle photo upload
-    photo_filename = None
-    if 'photo' in request.files:
-        photo = request.files['photo']
-        if photo and photo.filename:
-            # Generate secure filename
-            import os
-            import uuid
-            from werkzeug.utils import secure_filename
-            
-            filename = secure_filename(photo.filename)
-            if filename:
-                # Create unique filename
-                file_ext = os.path.splitext(filename)[1]
-                unique_filename = f"{uuid.uuid4()}{file_ext}"
-                
-                # Save file
-                photo_path = os.path.join('static', 'uploads', 'leaders')
-                os.makedirs(photo_path, exist_ok=True)
-                photo.save(os.path.join(photo_path, unique_filename))
-                photo_filename = f"uploads/leaders/{unique_filename}"
+    photo_filename = store_upload(cur, request.files.get('photo'))
     
     cur.execute('INSERT INTO leaders(date, name, message, photo) VALUES(?,?,?,?)', (
         request.form.get('date'), 
@@ -1025,6 +3133,7 @@ def admin_add_leader():
         photo_filename
     ))
     conn.commit()
+    page_cache.invalidate('leaders')
     conn.close()
     flash('Лидер добавлен', 'success')
     return redirect(url_for('admin_leader'))
@@ -1045,26 +3154,7 @@ def admin_edit_leader(leader_id: int):
         message = request.form.get('message', '').strip()
         
         # Handle photo upload
-        photo_filename = None
-        if 'photo' in request.files:
-            photo = request.files['photo']
-            if photo and photo.filename:
-                # Generate secure filename
-                import os
-                import uuid
-                from werkzeug.utils import secure_filename
-                
-                filename = secure_filename(photo.filename)
-                if filename:
-                    # Create unique filename
-                    file_ext = os.path.splitext(filename)[1]
-                    unique_filename = f"{uuid.uuid4()}{file_ext}"
-                    
-                    # Save file
-                    photo_path = os.path.join('static', 'uploads', 'leaders')
-                    os.makedirs(photo_path, exist_ok=True)
-                    photo.save(os.path.join(photo_path, unique_filename))
-                    photo_filename = f"uploads/leaders/{unique_filename}"
+        photo_filename = store_upload(cur, request.files.get('photo'))
         
         # Update leader with or without new photo
         if photo_filename:
@@ -1075,6 +3165,7 @@ def admin_edit_leader(leader_id: int):
                        (date, name, message, leader_id))
         
         conn.commit()
+        page_cache.invalidate('leaders')
         conn.close()
         flash('Лидер обновлен', 'success')
         return redirect(url_for('admin_leader'))
@@ -1094,32 +3185,85 @@ def admin_edit_leader(leader_id: int):
 @app.route('/notifications/mark_read/<int:notification_id>', methods=['POST'])
 def mark_notification_read_route(notification_id):
     """Отметить уведомление как прочитанное"""
-    if not session.get('user_id'):
+    recipient = notification_recipient()
+    if recipient is None:
+        return redirect(url_for('login'))
+    
+    mark_notification_read(notification_id, *recipient)
+    notify_subscribers(get_db(), {'event': 'read', 'recipient_role': recipient[0], 'recipient_id': recipient[1]})
+    return jsonify({'success': True})
+
+@app.route('/notifications/mark_all_read', methods=['POST'])
+def mark_all_notifications_read_route():
+    """Отметить прочитанными все уведомления текущего получателя"""
+    recipient = notification_recipient()
+    if recipient is None:
         return redirect(url_for('login'))
     
-    mark_notification_read(notification_id)
+    mark_all_notifications_read(*recipient)
+    notify_subscribers(get_db(), {'event': 'read', 'recipient_role': recipient[0], 'recipient_id': recipient[1]})
     return jsonify({'success': True})
 
 @app.route('/notifications/get_unread_count')
 def get_unread_count_route():
     """Получить количество непрочитанных уведомлений"""
-    if not session.get('user_id'):
+    recipient = notification_recipient()
+    if recipient is None:
         return jsonify({'count': 0})
     
-    user_role = session.get('user_role')
-    user_id = session.get('user_id')
-    count = get_unread_count(user_role, user_id)
-    return jsonify({'count': count})
+    count = get_unread_count(*recipient)
+    response = jsonify({'count': count})
+    # Повторный опрос с тем же счётчиком получает 304 без тела
+    response.set_etag(f'{recipient[0]}-{recipient[1]}-{count}')
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response.make_conditional(request)
+
+@app.route('/notifications/stream')
+def notifications_stream():
+    """Поток Server-Sent Events со счётчиком и новыми уведомлениями"""
+    recipient = notification_recipient()
+    if recipient is None:
+        return Response(status=401)
+    if not NOTIFICATIONS_SSE:
+        # 204 закрывает EventSource, и клиент переходит на опрос
+        return Response(status=204)
+
+    role, recipient_id = recipient
+    count = get_unread_count(role, recipient_id)
+    subscription = notification_broker.subscribe(role, recipient_id)
+
+    def stream():
+        # Выполняется после завершения запроса, без соединения из g
+        try:
+            yield 'retry: 5000\n\n'
+            yield sse_event('count', {'count': count})
+            deadline = time.monotonic() + SSE_MAX_DURATION
+            while time.monotonic() < deadline:
+                try:
+                    event = subscription.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event.get('event') == 'notification':
+                    yield sse_event('notification', event)
+                yield sse_event('count', {'count': get_unread_count(role, recipient_id)})
+        finally:
+            notification_broker.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/notifications/get_all')
 def get_all_notifications_route():
     """Получить все уведомления пользователя"""
-    if not session.get('user_id'):
+    recipient = notification_recipient()
+    if recipient is None:
         return redirect(url_for('login'))
     
-    user_role = session.get('user_role')
-    user_id = session.get('user_id')
-    notifications = get_notifications(user_role, user_id)
+    notifications = get_notifications(*recipient)
     return jsonify({'notifications': notifications})
 
 
@@ -1144,56 +3288,209 @@ def internet_reception():
         violator_roblox = request.form.get('violator_roblox','').strip()
         details = request.form.get('what_happened','').strip()
 
-        image_path = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                import time
-                timestamp = str(int(time.time()))
-                name, ext = os.path.splitext(filename)
-                filename = f"complaint_{name}_{timestamp}{ext}"
-                filepath = UPLOAD_FOLDER / filename
-                file.save(filepath)
-                image_path = f'/uploads/{filename}'
-
         conn = get_db()
+        image_path = store_upload(conn.cursor(), request.files.get('image'))
         conn.execute(
             'INSERT INTO complaints(fio, nick_ds, violator_ds, violator_roblox, details, image) VALUES(?,?,?,?,?,?)',
             (fio, nick_ds, violator_ds, violator_roblox, details, image_path)
         )
-        conn.commit()
-        conn.close()
-        
-        # Создать уведомления для админов и прокуроров
-        create_notification(
+        cur = conn.cursor()
+        bump_counter(cur, 'complaints')
+        # Уведомления для админов и прокуроров — фоновой задачей
+        enqueue_job(
+            cur, 'notify',
             title="Новая жалоба получена",
             message=f"Поступила жалоба от {fio}",
             notification_type="complaint",
-            recipient_role="admin"
-        )
-        create_notification(
-            title="Новая жалоба получена", 
-            message=f"Поступила жалоба от {fio}",
-            notification_type="complaint",
-            recipient_role="prosecutor"
+            recipient_roles=["admin", "prosecutor"],
         )
+        conn.commit()
+        page_cache.invalidate('stats')
+        conn.close()
+        wake_job_workers()
         return render_template('submitted.html', title='Жалоба отправлена', message='Спасибо! Обращение получено.')
     return render_template('internet-reception.html')
 
 
+# ------------------ Document ingest ------------------
+# После добавления документа фоновая задача разбирает локальный PDF
+# (/pdf/..., /uploads/...): число страниц, размер, текст и превью первой
+# страницы сохраняются в documents, текст попадает в поисковый индекс.
+# Внешние ссылки (Google Docs и т.п.) помечаются как skipped.
+# Для уже существующих документов: flask ingest-documents.
+DOCUMENT_PREVIEW_WIDTH = 320
+DOCUMENT_PREVIEW_QUALITY = 75
+DOCUMENT_PREVIEW_FOLDER = UPLOAD_FOLDER / '.previews'
+DOCUMENT_TEXT_LIMIT = 200_000  # символов текста на документ в индексе
+DOCUMENTS_SEARCH_LIMIT = 50
+
+_pdfium_lock = threading.Lock()  # pdfium не потокобезопасен
+
+
+def document_local_path(url):
+    """Путь к локальному файлу документа по его URL или None для внешних ссылок"""
+    for prefix, directory in ASSET_DIRECTORIES.items():
+        if url and url.startswith(prefix):
+            path = safe_join(os.path.join(app.root_path, directory), url[len(prefix):].split('?', 1)[0])
+            if path and os.path.isfile(path):
+                return path
+            return None
+    return None
+
+
+def extract_pdf(path):
+    """Число страниц, текст и картинка первой страницы (PIL) из PDF"""
+    with _pdfium_lock:
+        return _extract_pdf(path)
+
+
+def _extract_pdf(path):
+    pdf = pdfium.PdfDocument(path)
+    try:
+        pages = len(pdf)
+        parts, length = [], 0
+        for index in range(pages):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            page.close()
+            parts.append(text)
+            length += len(text)
+            if length >= DOCUMENT_TEXT_LIMIT:
+                break
+        preview = None
+        if pages:
+            page = pdf[0]
+            preview = page.render(scale=DOCUMENT_PREVIEW_WIDTH / page.get_width()).to_pil()
+            page.close()
+    finally:
+        pdf.close()
+    text = re.sub(r'\s+', ' ', ' '.join(parts)).strip()[:DOCUMENT_TEXT_LIMIT]
+    return pages, text, preview
+
+
+@job_handler('document_ingest')
+def ingest_document(doc_id):
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT url FROM documents WHERE id = ?', (doc_id,))
+        row = cur.fetchone()
+        if row is None:
+            return
+        path = document_local_path(row['url'])
+        if path is None or pdfium is None or not path.lower().endswith('.pdf'):
+            size = os.path.getsize(path) if path else None
+            cur.execute("UPDATE documents SET size = ?, ingest_status = 'skipped' WHERE id = ?", (size, doc_id))
+            conn.commit()
+            return
+        try:
+            pages, text, preview = extract_pdf(path)
+            preview_url = None
+            if preview is not None:
+                # Имя по отпечатку содержимого: новое превью при замене файла
+                name = f'{file_fingerprint(path)}.jpg'
+                DOCUMENT_PREVIEW_FOLDER.mkdir(exist_ok=True)
+                preview.convert('RGB').save(DOCUMENT_PREVIEW_FOLDER / name, format='JPEG',
+                                            quality=DOCUMENT_PREVIEW_QUALITY, optimize=True)
+                preview_url = f'/uploads/.previews/{name}'
+        except Exception:
+            cur.execute("UPDATE documents SET ingest_status = 'failed' WHERE id = ?", (doc_id,))
+            conn.commit()
+            raise
+        cur.execute("""UPDATE documents SET pages = ?, size = ?, preview = ?, content = ?, ingest_status = 'done'
+                       WHERE id = ?""", (pages, os.path.getsize(path), preview_url, text, doc_id))
+        conn.commit()
+    finally:
+        conn.close()
+    page_cache.invalidate('documents')
+
+
+@app.cli.command('ingest-documents')
+@click.option('--all', 'reingest', is_flag=True, help='Разобрать заново все документы')
+def ingest_documents_command(reingest):
+    """Разобрать документы без метаданных (или все с --all)"""
+    conn = get_db()
+    cur = conn.cursor()
+    if reingest:
+        cur.execute('SELECT id FROM documents ORDER BY id')
+    else:
+        cur.execute("SELECT id FROM documents WHERE COALESCE(ingest_status, 'pending') IN ('pending', 'failed') ORDER BY id")
+    ids = [r[0] for r in cur.fetchall()]
+    conn.close()
+    for doc_id in ids:
+        try:
+            ingest_document(doc_id)
+        except Exception as e:
+            print(f'Document {doc_id} failed: {e}')
+    print(f'Ingested {len(ids)} documents')
+
+
+def search_documents(cur, q, limit=DOCUMENTS_SEARCH_LIMIT):
+    """Документы по релевантности с подсвеченным фрагментом текста (snippet_html)"""
+    columns = 'd.date, d.title, d.description, d.url, d.pages, d.size, d.preview'
+    if DB_TYPE == 'postgresql':
+        options = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MinWords=15, MaxWords=35'
+        cur.execute(f'''
+            SELECT {columns},
+                   ts_headline('russian', coalesce(d.content, d.description, ''), query, ?) AS snippet
+            FROM documents d, websearch_to_tsquery('russian', ?) AS query
+            WHERE d.search_vector @@ query
+            ORDER BY ts_rank(d.search_vector, query) DESC, d.id DESC
+            LIMIT ?
+        ''', (options, q, limit))
+    else:
+        match = fts_match_query(q)
+        if not match:
+            return []
+        cur.execute(f'''
+            SELECT {columns},
+                   snippet(documents_fts, 2, ?, ?, '…', 24) AS snippet
+            FROM documents_fts
+            JOIN documents d ON d.id = documents_fts.rowid
+            WHERE documents_fts MATCH ?
+            ORDER BY bm25(documents_fts, 10.0, 3.0, 1.0), d.id DESC
+            LIMIT ?
+        ''', (HIGHLIGHT_START, HIGHLIGHT_END, match, limit))
+    rows = []
+    for r in cur.fetchall():
+        item = dict(r)
+        snippet = item.pop('snippet')
+        item['snippet_html'] = highlight_markup(snippet) if snippet and HIGHLIGHT_START in snippet else None
+        rows.append(item)
+    return rows
+
+
+@app.template_filter('file_size')
+def file_size(size):
+    if not size:
+        return ''
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024 or unit == 'МБ':
+            break
+        size /= 1024
+    return f'{size:.0f} {unit}' if unit == 'Б' else f'{size:.1f} {unit}'.replace('.', ',')
+
+
 @app.route('/documents')
+@cached_page('documents', bypass_args=('q',))
 def documents():
+    q = request.args.get('q', '').strip()
     conn = get_db()
     cur = conn.cursor()
-    cur.execute('SELECT date, title, description, url FROM documents ORDER BY id DESC')
-    docs = [dict(r) for r in cur.fetchall()]
+    if q:
+        docs = search_documents(cur, q)
+    else:
+        cur.execute('SELECT date, title, description, url, pages, size, preview FROM documents ORDER BY id DESC')
+        docs = [dict(r) for r in cur.fetchall()]
     conn.close()
-    return render_template('documents.html', documents=docs)
+    return render_template('documents.html', documents=docs, q=q)
 
 
 # Страница "Органы и организации прокуратуры"
 @app.route('/organs')
+@cached_page('organs')
 def organs():
     conn = get_db()
     cur = conn.cursor()
@@ -1203,26 +3500,156 @@ def organs():
     return render_template('organs.html', items=items)
 
 
+# ------------------ Static delivery ------------------
+# Файлы из logo/, pdf/, uploads/ и static/ отдаются через serve_file:
+# - URL с отпечатком содержимого (?v=..., см. asset_url) кэшируются на год
+#   как immutable, остальные — на STATIC_MAX_AGE;
+# - Range/If-Range поддерживаются (send_file с conditional=True), так что
+#   просмотрщик PDF может читать файл частями;
+# - если рядом лежит file.br / file.gz (flask precompress), отдается он;
+# - STATIC_OFFLOAD=x-accel|x-sendfile передает отдачу байтов фронт-прокси.
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', 3600))
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+STATIC_OFFLOAD = os.getenv('STATIC_OFFLOAD', '').lower()
+X_ACCEL_PREFIX = os.getenv('X_ACCEL_PREFIX', '/protected').rstrip('/')
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+PRECOMPRESS_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.xml'}
+ASSET_DIRECTORIES = {'/logo/': 'logo', '/pdf/': 'pdf', '/uploads/': 'uploads', '/static/': 'static'}
+app.config['USE_X_SENDFILE'] = STATIC_OFFLOAD == 'x-sendfile'
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def file_fingerprint(path):
+    """Короткий хэш содержимого файла (пересчитывается при изменении mtime/размера)"""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    fingerprint = digest.hexdigest()[:12]
+    with _fingerprints_lock:
+        _fingerprints[path] = (key, fingerprint)
+    return fingerprint
+
+
+@app.template_global()
+@app.template_filter('asset_url')
+def asset_url(url):
+    """Добавить к URL локального файла отпечаток ?v=..., включающий долгий кэш"""
+    if not url:
+        return url
+    for prefix, directory in ASSET_DIRECTORIES.items():
+        if url.startswith(prefix) and '?' not in url:
+            path = safe_join(os.path.join(app.root_path, directory), url[len(prefix):])
+            if path and os.path.isfile(path):
+                return f'{url}?v={file_fingerprint(path)}'
+            break
+    return url
+
+
+def serve_file(directory, filename, max_age=None):
+    root = os.path.join(app.root_path, directory)
+    path = safe_join(root, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    served, encoding = filename, None
+    for name, suffix in PRECOMPRESSED:
+        if name in request.accept_encodings and os.path.isfile(path + suffix):
+            served, encoding = filename + suffix, name
+            break
+
+    immutable = request.args.get('v') == file_fingerprint(path)
+    if immutable:
+        max_age = STATIC_IMMUTABLE_MAX_AGE
+    elif max_age is None:
+        max_age = STATIC_MAX_AGE
+
+    if STATIC_OFFLOAD == 'x-accel':
+        # Байты отдает nginx из internal-локации X_ACCEL_PREFIX/<directory>/
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f'{X_ACCEL_PREFIX}/{directory}/{served}'
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response = send_from_directory(root, served, mimetype=mimetype, max_age=max_age)
+    if encoding:
+        response.content_encoding = encoding
+    if any(os.path.isfile(path + suffix) for _, suffix in PRECOMPRESSED):
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+def static_files(filename: str):
+    return serve_file('static', filename)
+
+
+app.view_functions['static'] = static_files
+
+
+@app.cli.command('precompress')
+def precompress_command():
+    """Создать .gz (и .br, если установлен brotli) рядом с текстовыми файлами static/"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    count = 0
+    for root, _dirs, files in os.walk(app.static_folder):
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in PRECOMPRESS_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data))
+            count += 1
+    print(f'Precompressed {count} files')
+
+
 # Статика для логотипа и других файлов из папки logo
 @app.route('/logo/<path:filename>')
 def logo_files(filename: str):
-    return send_from_directory('logo', filename)
+    return serve_file('logo', filename)
 
 
 # Статика для загруженных файлов
 @app.route('/uploads/<path:filename>')
 def uploaded_files(filename: str):
-    return send_from_directory('uploads', filename)
+    width = request.args.get('w', type=int)
+    if width:
+        fmt = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
+        variant = image_variant(filename, width, fmt)
+        if variant:
+            response = serve_file('uploads', variant, max_age=86400)
+            response.vary.add('Accept')
+            return response
+    return serve_file('uploads', filename)
 
 
 # Статика для PDF файлов
 @app.route('/pdf/<path:filename>')
 def pdf_files(filename: str):
-    return send_from_directory('pdf', filename)
+    return serve_file('pdf', filename)
 
 
 # Пример маршрута контактов (страница пока не создана)
 @app.route('/contacts')
+@cached_page('contacts')
 def contacts():
     conn = get_db()
     cur = conn.cursor()
@@ -1233,47 +3660,21 @@ def contacts():
 
 
 @app.route('/erknm')
+@cached_page('stats')
 def erknm():
     conn = get_db()
     cur = conn.cursor()
-    
-    # Считаем количество сотрудников
-    cur.execute('SELECT COUNT(*) FROM employees')
-    employees_count = cur.fetchone()[0]
-    
-    # Считаем количество жалоб
-    cur.execute('SELECT COUNT(*) FROM complaints')
-    complaints_processed = cur.fetchone()[0]
-    
-    # Считаем количество заявок на работу
-    cur.execute('SELECT COUNT(*) FROM job_applications')
-    job_applications = cur.fetchone()[0]
-    
-    # Считаем количество одобренных заявок
-    cur.execute('SELECT COUNT(*) FROM job_applications WHERE status="approved"')
-    approved_applications = cur.fetchone()[0]
-    
-    # Считаем количество пользователей
-    cur.execute('SELECT COUNT(*) FROM user_accounts')
-    user_accounts = cur.fetchone()[0]
-    
-    # Политиков снято (берем из настроек app_settings)
-    cur.execute('SELECT value FROM app_settings WHERE key=?', ('politicians_removed',))
-    row = cur.fetchone()
-    try:
-        politicians_removed = int(row[0]) if row and row[0] is not None else 0
-    except Exception:
-        politicians_removed = 0
-    
+    cur.execute('SELECT name, value FROM stats_counters')
+    counters = {r['name']: r['value'] for r in cur.fetchall()}
     conn.close()
-    
-    return render_template('erknm.html', 
-                         employees_count=employees_count,
-                         complaints_processed=complaints_processed,
-                         politicians_removed=politicians_removed,
-                         job_applications=job_applications,
-                         approved_applications=approved_applications,
-                         user_accounts=user_accounts)
+
+    return render_template('erknm.html',
+                         employees_count=counters.get('employees', 0),
+                         complaints_processed=counters.get('complaints', 0),
+                         politicians_removed=counters.get('politicians_removed', 0),
+                         job_applications=counters.get('job_applications', 0),
+                         approved_applications=counters.get('approved_applications', 0),
+                         user_accounts=counters.get('user_accounts', 0))
 
 
 @app.route('/admin/stats', methods=['GET', 'POST'])
@@ -1284,12 +3685,17 @@ def admin_stats():
     conn = get_db()
     cur = conn.cursor()
     if request.method == 'POST':
-        value = request.form.get('politicians_removed', '0').strip()
+        try:
+            value = int(request.form.get('politicians_removed', '0').strip())
+        except ValueError:
+            value = 0
         # upsert настройку
         cur.execute("INSERT INTO app_settings(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (
-            'politicians_removed', value
+            'politicians_removed', str(value)
         ))
+        set_counter(cur, 'politicians_removed', value)
         conn.commit()
+        page_cache.invalidate('stats')
         conn.close()
         flash('Статистика обновлена', 'success')
         return redirect(url_for('admin_stats'))
@@ -1302,12 +3708,205 @@ def admin_stats():
     return render_template('admin/stats.html', politicians_removed=current_value, unread_count=unread_count)
 
 
+@app.route('/admin/stats/recount', methods=['POST'])
+def admin_stats_recount():
+    if not is_admin():
+        flash('Необходимо войти как администратор', 'error')
+        return redirect(url_for('login'))
+    reconcile_stats()
+    flash('Счётчики пересчитаны', 'success')
+    return redirect(url_for('admin_stats'))
+
+
+@app.route('/admin/db/pool')
+def admin_db_pool():
+    """Метрики пула соединений: ожидание, выдачи, переполнение"""
+    if not is_admin():
+        return redirect(url_for('admin_login'))
+    return jsonify(db_pool.stats())
+
+
+@app.route('/admin/db/queries')
+def admin_db_queries():
+    """Запросы к БД и время по эндпоинтам, самые дорогие SQL и медленные запросы"""
+    if not is_admin():
+        return redirect(url_for('admin_login'))
+    with query_stats_lock:
+        endpoints = {
+            endpoint: {
+                'requests': stats['requests'],
+                'queries': stats['queries'],
+                'max_queries': stats['max_queries'],
+                'avg_queries': round(stats['queries'] / stats['requests'], 2),
+                'total_ms': round(stats['time'] * 1000, 1),
+                'avg_ms': round(stats['time'] / stats['requests'] * 1000, 2),
+                'max_ms': round(stats['max_time'] * 1000, 1),
+                **{f'{kind}_ms': round(stats[f'{kind}_time'] * 1000, 1) for kind in REQUEST_TIMINGS},
+            }
+            for endpoint, stats in query_stats.items()
+        }
+        statements = sorted(statement_stats.items(), key=lambda item: item[1]['time'], reverse=True)[:25]
+        statements = [
+            {'sql': sql, 'calls': stats['calls'], 'total_ms': round(stats['time'] * 1000, 1),
+             'max_ms': round(stats['max_time'] * 1000, 1)}
+            for sql, stats in statements
+        ]
+        slow = list(slow_queries)
+    return jsonify({'endpoints': endpoints, 'statements': statements, 'slow_queries': slow,
+                    'slow_query_ms': SLOW_QUERY_MS})
+
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    """Метрики процесса в текстовом формате Prometheus"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            label_text = ','.join(f'{k}="{prometheus_label(v)}"' for k, v in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+
+    with query_stats_lock:
+        endpoints = {endpoint: dict(stats, buckets=list(stats['buckets'])) for endpoint, stats in query_stats.items()}
+        slow_total = instrumentation_counters['slow_queries']
+
+    histogram = []
+    for endpoint, stats in endpoints.items():
+        cumulative = 0
+        for bound, count in zip(REQUEST_DURATION_BUCKETS, stats['buckets']):
+            cumulative += count
+            histogram.append(({'endpoint': endpoint, 'le': bound}, cumulative))
+        histogram.append(({'endpoint': endpoint, 'le': '+Inf'}, stats['requests']))
+    lines.append('# HELP app_http_request_duration_seconds Request duration by endpoint')
+    lines.append('# TYPE app_http_request_duration_seconds histogram')
+    for labels, value in histogram:
+        lines.append(f'app_http_request_duration_seconds_bucket{{endpoint="{prometheus_label(labels["endpoint"])}",le="{labels["le"]}"}} {value}')
+    for endpoint, stats in endpoints.items():
+        lines.append(f'app_http_request_duration_seconds_sum{{endpoint="{prometheus_label(endpoint)}"}} {stats["time"]:.6f}')
+        lines.append(f'app_http_request_duration_seconds_count{{endpoint="{prometheus_label(endpoint)}"}} {stats["requests"]}')
+
+    for kind in REQUEST_TIMINGS:
+        metric(f'app_http_request_{kind}_seconds_total', 'counter', f'Time spent in {kind} while handling requests',
+               [({'endpoint': e}, f'{st[f"{kind}_time"]:.6f}') for e, st in endpoints.items()])
+    metric('app_db_queries_total', 'counter', 'Database queries issued by requests',
+           [({'endpoint': e}, st['queries']) for e, st in endpoints.items()])
+    metric('app_db_slow_queries_total', 'counter', f'Queries slower than {SLOW_QUERY_MS:g} ms', [({}, slow_total)])
+
+    pool = db_pool.stats()
+    metric('app_db_pool_checked_out', 'gauge', 'Connections checked out of the pool', [({}, pool['checked_out'])])
+    metric('app_db_pool_idle', 'gauge', 'Idle pooled connections', [({}, pool['idle'])])
+    metric('app_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection',
+           [({}, f"{pool['wait_time_total']:.6f}")])
+
+    with retention_stats_lock:
+        archived = retention_stats['archived_total']
+    metric('app_notifications_archived_total', 'counter', 'Notifications moved to the archive', [({}, archived)])
+    metric('app_sse_subscribers', 'gauge', 'Open notification streams', [({}, notification_broker.subscriber_count())])
+    with rate_limit_lock:
+        rejections = dict(rate_limit_rejections)
+    metric('app_rate_limited_total', 'counter', 'POST requests rejected by rate limiting',
+           [({'endpoint': e}, n) for e, n in rejections.items()])
+    fragments = fragment_cache.stats()
+    metric('app_template_fragment_cache_total', 'counter', 'Template fragment cache lookups',
+           [({'result': 'hit'}, fragments['hits']), ({'result': 'miss'}, fragments['misses'])])
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def metrics():
+    """Метрики для Prometheus: админ-сессия или Authorization: Bearer METRICS_TOKEN"""
+    authorized = is_admin() or (
+        METRICS_TOKEN and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+    )
+    if not authorized:
+        return Response(status=401)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def admin_profiler():
+    """Семплирующий профилировщик: POST action=start|stop|reset, GET — сводка
+    (?format=collapsed — свернутые стеки для flamegraph.pl/speedscope)"""
+    if not is_admin():
+        return redirect(url_for('admin_login'))
+    if request.method == 'POST':
+        action = request.form.get('action') or request.args.get('action')
+        if action == 'start':
+            if not sampling_profiler.start():
+                return jsonify({'error': 'профилировщик не работает с воркерами gevent'}), 409
+        elif action == 'stop':
+            sampling_profiler.stop()
+        elif action == 'reset':
+            sampling_profiler.reset()
+        else:
+            return jsonify({'error': 'action: start, stop или reset'}), 400
+    if request.args.get('format') == 'collapsed':
+        return Response(sampling_profiler.collapsed(), mimetype='text/plain')
+    return jsonify(sampling_profiler.summary())
+
+
+@app.route('/admin/notifications/retention')
+def admin_notifications_retention():
+    """Метрики архивации уведомлений и размер рабочих таблиц"""
+    if not is_admin():
+        return redirect(url_for('admin_login'))
+    conn = get_db()
+    cur = conn.cursor()
+    sizes = {}
+    for table in ('notification_messages', 'notification_recipients', 'notification_archive'):
+        cur.execute(f'SELECT COUNT(*) FROM {table}')
+        sizes[table] = cur.fetchone()[0]
+    conn.close()
+    with retention_stats_lock:
+        stats = dict(retention_stats)
+    return jsonify({
+        'retention_days': NOTIFICATION_RETENTION_DAYS,
+        'unread_max_days': NOTIFICATION_UNREAD_MAX_DAYS,
+        'retention_by_type': NOTIFICATION_RETENTION_BY_TYPE,
+        'archive': NOTIFICATION_ARCHIVE_DIR or 'notification_archive',
+        'stats': stats,
+        'rows': sizes,
+    })
+
+
+@app.route('/admin/jobs/queue')
+def admin_jobs_queue():
+    """Состояние очереди фоновых задач и последние ошибки"""
+    if not is_admin():
+        return redirect(url_for('admin_login'))
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute('SELECT kind, status, COUNT(*) AS jobs FROM background_jobs GROUP BY kind, status')
+    counts = [dict(r) for r in cur.fetchall()]
+    cur.execute("""SELECT id, kind, status, attempts, last_error FROM background_jobs
+                   WHERE last_error IS NOT NULL ORDER BY id DESC LIMIT 20""")
+    errors = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return jsonify({'workers': JOB_WORKERS, 'counts': counts, 'recent_errors': errors})
+
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Выполнить готовые задачи и выйти')
+def run_jobs_command(once):
+    """Выполнять фоновые задачи в этом процессе (для JOB_WORKERS=0)"""
+    if once:
+        print(f'Ran {run_pending_jobs()} jobs')
+        return
+    job_worker()
+
+
 @app.route('/anticorruption')
 def anticorruption():
     return render_template('anticorruption.html')
 
 
 @app.route('/leadership')
+@cached_page('leaders')
 def leadership():
     conn = get_db()
     cur = conn.cursor()
@@ -1345,20 +3944,22 @@ def hotline():
         
         # Сохраняем обращение в БД
         conn = get_db()
-        conn.execute(
+        cur = conn.cursor()
+        cur.execute(
             'INSERT INTO hotline_appeals(fio, organization, subject, message) VALUES(?,?,?,?)',
             (fio, organization, subject, message)
         )
-        conn.commit()
-        conn.close()
-        
-        # Создать уведомление для админов
-        create_notification(
+        # Уведомление для админов — фоновой задачей
+        enqueue_job(
+            cur, 'notify',
             title="Новое обращение на горячую линию",
             message=f"Поступило обращение от {fio} на тему: {subject}",
             notification_type="hotline_appeal",
-            recipient_role="admin"
+            recipient_roles=["admin"],
         )
+        conn.commit()
+        conn.close()
+        wake_job_workers()
         
         return render_template('submitted.html', title='Обращение отправлено', message='Спасибо! Ваше обращение принято.')
     
@@ -1387,6 +3988,7 @@ def admin_contacts_add():
         request.form.get('label','').strip(), request.form.get('value','').strip()
     ))
     conn.commit()
+    page_cache.invalidate('contacts')
     conn.close()
     return redirect(url_for('admin_contacts'))
 
@@ -1398,6 +4000,7 @@ def admin_contacts_delete(item_id: int):
     conn = get_db()
     conn.execute('DELETE FROM contacts WHERE id=?', (item_id,))
     conn.commit()
+    page_cache.invalidate('contacts')
     conn.close()
     return redirect(url_for('admin_contacts'))
 
@@ -1430,16 +4033,22 @@ def admin_approve_job(app_id: int):
     # Create user account
     try:
         cur.execute('INSERT INTO user_accounts(username, password, full_name, role, created_from_application) VALUES(?,?,?,?,?)',
-                    (desired_login, desired_password, char_name, 'employee', app_id))
+                    (desired_login, desired_password if is_password_hash(desired_password) else hash_password(desired_password or ''),
+                     char_name, 'employee', app_id))
         # Also create employee directory record
         safe_position = (char_job or 'Сотрудник').strip() or 'Сотрудник'
         safe_contact = (nick_ds or '').strip()
         cur.execute('INSERT INTO employees(name, position, contact) VALUES(?,?,?)', (char_name, safe_position, safe_contact))
         
+        bump_counter(cur, 'user_accounts')
+        bump_counter(cur, 'employees')
+
         # Update application status
-        cur.execute('UPDATE job_applications SET status="approved" WHERE id=?', (app_id,))
+        cur.execute("UPDATE job_applications SET status='approved', updated_at=CURRENT_TIMESTAMP WHERE id=? AND COALESCE(status, '') <> 'approved'", (app_id,))
+        bump_counter(cur, 'approved_applications', cur.rowcount)
         
         conn.commit()
+        page_cache.invalidate('stats')
         conn.close()
         flash(f'Заявка одобрена! Создан аккаунт для {char_name}', 'success')
         return redirect(url_for('admin_jobs'))
@@ -1457,110 +4066,83 @@ def admin_reject_job(app_id: int):
         return redirect(url_for('admin_login'))
     
     conn = get_db()
-    conn.execute('UPDATE job_applications SET status="rejected" WHERE id=?', (app_id,))
+    cur = conn.cursor()
+    cur.execute("SELECT status FROM job_applications WHERE id=?", (app_id,))
+    row = cur.fetchone()
+    cur.execute("UPDATE job_applications SET status='rejected', updated_at=CURRENT_TIMESTAMP WHERE id=?", (app_id,))
+    if row and row['status'] == 'approved':
+        bump_counter(cur, 'approved_applications', -1)
     conn.commit()
+    page_cache.invalidate('stats')
     conn.close()
     flash('Заявка отклонена', 'info')
     return redirect(url_for('admin_jobs'))
 
 
+# Карточка заявки рендерится шаблоном admin/_job_details.html (фрагмент
+# кэшируется по id/updated_at/status). ETag строится из версий строк и
+# отпечатка шаблона: повторное открытие той же заявки получает 304.
+JOB_DETAIL_COLUMNS = (
+    'id, char_name, char_age, char_nationality, char_job, char_education, '
+    'nick_ds, nick_roblox, real_age, char_birth, date_now, '
+    'about, what_is_prosecutor, literacy_test, has_convictions, has_experience, '
+    "desired_login, CASE WHEN COALESCE(desired_password, '') <> '' THEN 1 ELSE 0 END AS has_password, "
+    'term_upk, term_uk, term_koap, term_tk, status, created_at, updated_at'
+)
+JOB_DETAILS_TEMPLATE = 'admin/_job_details.html'
+JOB_DETAILS_BATCH_MAX = ADMIN_PER_PAGE
+
+
+def load_job_details(ids):
+    conn = get_db()
+    cur = conn.cursor()
+    placeholders = ','.join('?' * len(ids))
+    cur.execute(f'SELECT {JOB_DETAIL_COLUMNS} FROM job_applications WHERE id IN ({placeholders})', ids)
+    rows = {r['id']: dict(r) for r in cur.fetchall()}
+    conn.close()
+    return [rows[i] for i in ids if i in rows]
+
+
+def job_details_response(rows, render):
+    """Ответ с ETag по версиям строк; тело рендерится только без совпадения"""
+    template = app.jinja_env.get_template(JOB_DETAILS_TEMPLATE)
+    versions = ','.join(f"{r['id']}:{r['updated_at']}:{r['status']}" for r in rows)
+    etag = hashlib.sha1(f'{file_fingerprint(template.filename)}|{versions}'.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = app.make_response(render())
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+
 @app.route('/admin/jobs/details/<int:app_id>')
 def admin_job_details(app_id: int):
     if not is_admin():
         return redirect(url_for('admin_login'))
-    
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM job_applications WHERE id=?', (app_id,))
-    app_data = cur.fetchone()
-    conn.close()
-    
-    if not app_data:
-        return jsonify({'error': 'Заявка не найдена'})
-    
-    # Convert to dict for easier access
-    app_dict = dict(app_data)
-    
-    # Generate HTML for the modal
-    html = f"""
-    <h2 style="color: #2d3748; margin-bottom: 20px;">Детали заявки #{app_dict['id']}</h2>
-    
-    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 20px; margin-bottom: 20px;">
-        <div>
-            <h3 style="color: #4a5568; margin-bottom: 10px;">Основная информация</h3>
-            <p><strong>ФИО персонажа:</strong> {app_dict['char_name'] or 'Не указано'}</p>
-            <p><strong>Возраст персонажа:</strong> {app_dict['char_age'] or 'Не указано'}</p>
-            <p><strong>Национальность:</strong> {app_dict['char_nationality'] or 'Не указано'}</p>
-            <p><strong>Работа персонажа:</strong> {app_dict['char_job'] or 'Не указано'}</p>
-            <p><strong>Образование:</strong> {app_dict['char_education'] or 'Не указано'}</p>
-        </div>
-        
-        <div>
-            <h3 style="color: #4a5568; margin-bottom: 10px;">Контактная информация</h3>
-            <p><strong>Ник в ДС:</strong> {app_dict['nick_ds'] or 'Не указано'}</p>
-            <p><strong>Ник в Roblox:</strong> {app_dict['nick_roblox'] or 'Не указано'}</p>
-            <p><strong>Реальный возраст:</strong> {app_dict['real_age'] or 'Не указано'}</p>
-            <p><strong>Дата рождения персонажа:</strong> {app_dict['char_birth'] or 'Не указано'}</p>
-            <p><strong>Дата подачи:</strong> {app_dict['date_now'] or 'Не указано'}</p>
-        </div>
-    </div>
-    
-    <div style="margin-bottom: 20px;">
-        <h3 style="color: #4a5568; margin-bottom: 10px;">О себе</h3>
-        <div style="background: #f7fafc; padding: 15px; border-radius: 8px; border-left: 4px solid #667eea;">
-            {app_dict['about'] or 'Не указано'}
-        </div>
-    </div>
-    
-    <div style="margin-bottom: 20px;">
-        <h3 style="color: #4a5568; margin-bottom: 10px;">Что такое прокуратура</h3>
-        <div style="background: #f7fafc; padding: 15px; border-radius: 8px; border-left: 4px solid #667eea;">
-            {app_dict['what_is_prosecutor'] or 'Не указано'}
-        </div>
-    </div>
-    
-    <div style="margin-bottom: 20px;">
-        <h3 style="color: #4a5568; margin-bottom: 10px;">Проверка грамотности</h3>
-        <div style="background: #f7fafc; padding: 15px; border-radius: 8px; border-left: 4px solid #667eea;">
-            {app_dict['literacy_test'] or 'Не указано'}
-        </div>
-    </div>
-    
-    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 20px; margin-bottom: 20px;">
-        <div>
-            <h3 style="color: #4a5568; margin-bottom: 10px;">Дополнительная информация</h3>
-            <p><strong>Судимости:</strong> {'Да' if app_dict['has_convictions'] == 'yes' else 'Нет' if app_dict['has_convictions'] == 'no' else 'Не указано'}</p>
-            <p><strong>Опыт:</strong> {'Да' if app_dict['has_experience'] == 'yes' else 'Нет' if app_dict['has_experience'] == 'no' else 'Не указано'}</p>
-        </div>
-        
-        <div>
-            <h3 style="color: #4a5568; margin-bottom: 10px;">Желаемые данные для входа</h3>
-            <p><strong>Логин:</strong> {app_dict['desired_login'] or 'Не указано'}</p>
-            <p><strong>Пароль:</strong> {'***' if app_dict['desired_password'] else 'Не указано'}</p>
-        </div>
-    </div>
-    
-    <div style="margin-bottom: 20px;">
-        <h3 style="color: #4a5568; margin-bottom: 10px;">Расшифровка терминов</h3>
-        <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 10px;">
-            <p><strong>УПК:</strong> {app_dict['term_upk'] or 'Не указано'}</p>
-            <p><strong>УК:</strong> {app_dict['term_uk'] or 'Не указано'}</p>
-            <p><strong>КоАП:</strong> {app_dict['term_koap'] or 'Не указано'}</p>
-            <p><strong>ТК:</strong> {app_dict['term_tk'] or 'Не указано'}</p>
-        </div>
-    </div>
-    
-    <div style="background: #e6fffa; padding: 15px; border-radius: 8px; border-left: 4px solid #10b981;">
-        <p><strong>Статус:</strong> 
-            <span style="color: {'#f59e0b' if app_dict['status'] == 'pending' else '#10b981' if app_dict['status'] == 'approved' else '#ef4444' if app_dict['status'] == 'rejected' else '#6b7280'}; font-weight: 600;">
-                {'Ожидает' if app_dict['status'] == 'pending' else 'Одобрено' if app_dict['status'] == 'approved' else 'Отклонено' if app_dict['status'] == 'rejected' else app_dict['status']}
-            </span>
-        </p>
-        <p><strong>Дата создания:</strong> {app_dict['created_at'] or 'Не указано'}</p>
-    </div>
-    """
-    
-    return jsonify({'html': html})
+    rows = load_job_details([app_id])
+    if not rows:
+        return 'Заявка не найдена', 404
+    return job_details_response(rows, lambda: render_template(JOB_DETAILS_TEMPLATE, a=rows[0]))
+
+
+@app.route('/admin/jobs/details')
+def admin_job_details_batch():
+    """Карточки нескольких заявок за один запрос: ?ids=3,2,1 → {"items": {id: html}}"""
+    if not is_admin():
+        return redirect(url_for('admin_login'))
+    try:
+        ids = list(dict.fromkeys(int(i) for i in request.args.get('ids', '').split(',') if i.strip()))
+    except ValueError:
+        abort(400)
+    if not ids or len(ids) > JOB_DETAILS_BATCH_MAX:
+        abort(400)
+    rows = load_job_details(ids)
+    return job_details_response(rows, lambda: jsonify(
+        {'items': {str(r['id']): render_template(JOB_DETAILS_TEMPLATE, a=r) for r in rows}}
+    ))
 
 
 @app.route('/admin/users')
@@ -1632,7 +4214,11 @@ def admin_delete_user(user_id: int):
     if user:
         # Delete user
         cur.execute('DELETE FROM user_accounts WHERE id=?', (user_id,))
+        cur.execute('DELETE FROM notification_recipients WHERE recipient_id=?', (user_id,))
+        cur.execute('DELETE FROM notification_unread_counters WHERE recipient_id=?', (user_id,))
+        bump_counter(cur, 'user_accounts', -1)
         conn.commit()
+        page_cache.invalidate('stats')
         flash(f'Пользователь {user[1]} ({user[0]}) удален', 'success')
     else:
         flash('Пользователь не найден', 'error')
@@ -1642,36 +4228,194 @@ def admin_delete_user(user_id: int):
 
 
 # ------------------ Prosecutor Panel ------------------
+# Жалобы — очередь работы прокуроров: фильтры (свободные, мои, по дате),
+# keyset-страницы и атомарный захват. Захват — один UPDATE по подзапросу;
+# на PostgreSQL подзапрос берет строки с FOR UPDATE SKIP LOCKED, поэтому
+# параллельные «взять следующие N» расходятся по разным жалобам, а не ждут
+# друг друга. SQLite сериализует запись сам.
+COMPLAINT_QUEUE_COLUMNS = 'created_at, fio, nick_ds, violator_ds, violator_roblox, details, image, claimed_by, claimed_at, updated_at'
+COMPLAINT_QUEUE_STATUSES = ('all', 'unclaimed', 'mine', 'claimed')
+COMPLAINT_CLAIM_MAX = int(os.getenv('COMPLAINT_CLAIM_MAX', 20))
+
+
+def prosecutor_name():
+    return session.get('proc_name', 'Прокурор')
+
+
+def parse_date_arg(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def complaint_queue_filters(args):
+    """Фильтры очереди из параметров запроса (неизвестные значения отбрасываются)"""
+    status = args.get('status', 'all')
+    since = parse_date_arg(args.get('since'))
+    until = parse_date_arg(args.get('until'))
+    return {
+        'status': status if status in COMPLAINT_QUEUE_STATUSES else 'all',
+        'since': since.isoformat() if since else '',
+        'until': until.isoformat() if until else '',
+    }
+
+
+def complaint_queue_page(filters, token, per_page=ADMIN_PER_PAGE):
+    conditions, params = [], []
+    if filters['status'] == 'unclaimed':
+        conditions.append('claimed_by IS NULL')
+    elif filters['status'] == 'claimed':
+        conditions.append('claimed_by IS NOT NULL')
+    elif filters['status'] == 'mine':
+        conditions.append('claimed_by = ?')
+        params.append(prosecutor_name())
+    if filters['since']:
+        conditions.append('created_at >= ?')
+        params.append(filters['since'])
+    if filters['until']:
+        # until включительно: всё до начала следующего дня
+        conditions.append('created_at < ?')
+        params.append((parse_date_arg(filters['until']) + timedelta(days=1)).isoformat())
+    conn = get_db()
+    cur = conn.cursor()
+    rows, prev_cursor, next_cursor = keyset_page(cur, 'complaints', COMPLAINT_QUEUE_COLUMNS, token, per_page,
+                                                 ' AND '.join(conditions), params)
+    conn.close()
+    return rows, {'prev': prev_cursor, 'next': next_cursor}
+
+
+def claim_complaints(claimer, ids=None, limit=1):
+    """Атомарно взять свободные жалобы в работу.
+
+    С ids — только перечисленные (уже занятые пропускаются), без ids — до
+    limit самых старых свободных. Возвращает id взятых жалоб.
+    """
+    skip_locked = 'FOR UPDATE SKIP LOCKED' if DB_TYPE == 'postgresql' else ''
+    scope, params = '', []
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))[:COMPLAINT_CLAIM_MAX]
+        if not ids:
+            return []
+        scope = f"AND id IN ({','.join('?' * len(ids))})"
+        params, limit = ids, len(ids)
+    limit = max(1, min(limit, COMPLAINT_CLAIM_MAX))
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(f'''
+            UPDATE complaints SET claimed_by = ?, claimed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE claimed_by IS NULL AND id IN (
+                SELECT id FROM complaints
+                WHERE claimed_by IS NULL {scope}
+                ORDER BY id
+                LIMIT ? {skip_locked}
+            )
+            RETURNING id
+        ''', (claimer, *params, limit))
+        claimed = sorted(r['id'] for r in cur.fetchall())
+        conn.commit()
+        return claimed
+    finally:
+        conn.close()
+
+
+def complaint_claimed_by(cid):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute('SELECT claimed_by FROM complaints WHERE id=?', (cid,))
+    row = cur.fetchone()
+    conn.close()
+    return row['claimed_by'] if row else None
+
+
+def redirect_to_queue():
+    """Назад в панель с теми же фильтрами, с которыми ее открывали"""
+    referrer = urlsplit(request.referrer or '')
+    panel = url_for('prosecutor_panel')
+    if referrer.path == panel and referrer.query:
+        return redirect(f'{panel}?{referrer.query}')
+    return redirect(panel)
+
+
 @app.route('/prosecutor')
 def prosecutor_panel():
     if not is_prosecutor():
         return redirect(url_for('login'))
+    filters = complaint_queue_filters(request.args)
+    complaints, pager = complaint_queue_page(filters, request.args.get('cursor', ''))
     conn = get_db()
     cur = conn.cursor()
-    cur.execute('SELECT id, created_at, fio, nick_ds, violator_ds, violator_roblox, details, image, claimed_by, claimed_at FROM complaints ORDER BY id DESC LIMIT 200')
-    complaints = [dict(r) for r in cur.fetchall()]
     cur.execute('SELECT id, created_by, title, description, url, status, created_at FROM documents_drafts ORDER BY id DESC LIMIT 100')
     drafts = [dict(r) for r in cur.fetchall()]
     conn.close()
     
     # Get notifications for prosecutor
-    notifications = get_notifications('prosecutor')
-    unread_count = get_unread_count('prosecutor')
+    recipient_id = session.get('user_id') if session.get('user_role') == 'prosecutor' else None
+    notifications = get_notifications('prosecutor', recipient_id)
+    unread_count = get_unread_count('prosecutor', recipient_id)
     
-    return render_template('prosecutor/panel.html', complaints=complaints, drafts=drafts, proc_name=session.get('proc_name','Прокурор'), notifications=notifications, unread_count=unread_count)
+    return render_template('prosecutor/panel.html', complaints=complaints, pager=pager, filters=filters,
+                           claim_max=COMPLAINT_CLAIM_MAX, drafts=drafts, proc_name=prosecutor_name(),
+                           notifications=notifications, unread_count=unread_count)
 
 
 @app.route('/prosecutor/claim/<int:cid>', methods=['POST'])
 def prosecutor_claim(cid: int):
     if not is_prosecutor():
         return redirect(url_for('login'))
-    conn = get_db()
-    conn.execute('UPDATE complaints SET claimed_by=?, claimed_at=CURRENT_TIMESTAMP WHERE id=? AND claimed_by IS NULL', (
-        session.get('proc_name','Прокурор'), cid
-    ))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('prosecutor_panel'))
+    if claim_complaints(prosecutor_name(), ids=[cid]):
+        flash(f'Жалоба #{cid} взята в работу', 'success')
+    else:
+        claimed_by = complaint_claimed_by(cid)
+        if claimed_by:
+            flash(f'Жалобу #{cid} уже взял(а) {claimed_by}', 'error')
+        else:
+            flash(f'Жалоба #{cid} не найдена', 'error')
+    return redirect_to_queue()
+
+
+@app.route('/prosecutor/claim-next', methods=['POST'])
+def prosecutor_claim_next():
+    """Взять N самых старых свободных жалоб"""
+    if not is_prosecutor():
+        return redirect(url_for('login'))
+    count = request.form.get('count', 1, type=int) or 1
+    claimed = claim_complaints(prosecutor_name(), limit=count)
+    if claimed:
+        flash(f"Взято в работу: {', '.join(f'#{cid}' for cid in claimed)}", 'success')
+    else:
+        flash('Свободных жалоб нет', 'info')
+    return redirect(url_for('prosecutor_panel', status='mine'))
+
+
+@app.route('/prosecutor/queue')
+def prosecutor_queue():
+    """Очередь жалоб в JSON: те же фильтры и курсоры, что и в панели"""
+    if not is_prosecutor():
+        return jsonify({'error': 'unauthorized'}), 401
+    filters = complaint_queue_filters(request.args)
+    items, pager = complaint_queue_page(filters, request.args.get('cursor', ''))
+    return jsonify({'items': items, 'filters': filters, 'prev': pager['prev'], 'next': pager['next']})
+
+
+@app.route('/prosecutor/queue/claim', methods=['POST'])
+def prosecutor_queue_claim():
+    """{"ids": [...]} — взять эти жалобы, {"count": N} — следующие N свободных"""
+    if not is_prosecutor():
+        return jsonify({'error': 'unauthorized'}), 401
+    payload = request.get_json(silent=True) or {}
+    ids, count = payload.get('ids'), payload.get('count', 1)
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return jsonify({'error': 'ids must be a list of integers'}), 400
+        if len(ids) > COMPLAINT_CLAIM_MAX:
+            return jsonify({'error': f'at most {COMPLAINT_CLAIM_MAX} ids per request'}), 400
+        claimed = claim_complaints(prosecutor_name(), ids=ids)
+        return jsonify({'claimed': claimed, 'lost': [i for i in dict.fromkeys(ids) if i not in claimed]})
+    if not isinstance(count, int) or count < 1:
+        return jsonify({'error': 'count must be a positive integer'}), 400
+    return jsonify({'claimed': claim_complaints(prosecutor_name(), limit=count)})
 
 
 @app.route('/prosecutor/draft/add', methods=['POST'])
@@ -1690,6 +4434,13 @@ def prosecutor_add_draft():
     return redirect(url_for('prosecutor_panel'))
 
 
+# Потоки запускаются после того, как зарегистрированы все обработчики задач
+start_job_workers()
+
+if TEMPLATE_WARMUP:
+    warm_templates()
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))
     debug = os.getenv('FLASK_ENV') != 'production'
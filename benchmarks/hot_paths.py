@@ -0,0 +1,362 @@
+"""Нагрузочный прогон горячих путей: p50/p95/p99 и пропускная способность в JSON.
+
+Запуск (SQLite, временная база, тестовый клиент и gunicorn):
+    python benchmarks/hot_paths.py --output bench/2025-06.json
+
+Объемы по умолчанию: 100k новостей ленты, 1M уведомлений, 50k жалоб.
+Для PostgreSQL задайте DATABASE_URL на пустую тестовую базу. Повторный
+запуск на той же базе (--sqlite-path или DATABASE_URL) не пересевает ее.
+Сравнение двух прогонов:
+    python benchmarks/hot_paths.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Сценарии: (имя, метод, путь, данные формы, роль сессии)
+SCENARIOS = [
+    ('index', 'GET', '/', None, None),
+    ('index_search', 'GET', '/?q=прокуратура+проверка', None, None),
+    ('erknm', 'GET', '/erknm', None, None),
+    ('prosecutor_panel', 'GET', '/prosecutor', None, 'prosecutor'),
+    ('admin_jobs', 'GET', '/admin/jobs', None, 'admin'),
+    ('post_jobs', 'POST', '/jobs', {
+        'nick_ds': 'bench#0001', 'nick_roblox': 'bench', 'char_name': 'Иван Бенчмарков', 'real_age': '20',
+        'char_age': '30', 'char_nationality': 'РФ', 'char_job': 'Следователь', 'about': 'нагрузочный тест',
+    }, None),
+    ('post_internet_reception', 'POST', '/internet-reception', {
+        'fio': 'Петр Бенчмарков', 'nick_ds': 'bench#0002', 'violator_ds': 'v#1', 'violator_roblox': 'v',
+        'what_happened': 'нагрузочный тест',
+    }, None),
+    ('post_hotline', 'POST', '/hotline', {
+        'name': 'Анна Бенчмаркова', 'organization': 'Бенч', 'subject': 'Проверка', 'message': 'нагрузочный тест',
+    }, None),
+]
+
+WORDS = ('прокуратура проверка надзор жалоба закон суд решение район город обращение '
+         'сотрудник приказ отчет заседание приём граждан нарушение права').split()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--feed', type=int, default=100_000)
+    parser.add_argument('--notifications', type=int, default=1_000_000)
+    parser.add_argument('--complaints', type=int, default=50_000)
+    parser.add_argument('--prosecutors', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8, help='параллельных клиентов в режиме http')
+    parser.add_argument('--mode', choices=('client', 'http', 'both'), default='both')
+    parser.add_argument('--gunicorn-workers', type=int, default=2)
+    parser.add_argument('--gunicorn-args', default='', help='доп. аргументы gunicorn, например "-k gthread --threads 4"')
+    parser.add_argument('--no-page-cache', action='store_true', help='PAGE_CACHE_TTL=0: мерить рендер, а не кэш')
+    parser.add_argument('--only', help='сценарии через запятую')
+    parser.add_argument('--sqlite-path', help='база SQLite (по умолчанию временная)')
+    parser.add_argument('--label', default='', help='метка прогона в JSON (версия, ветка)')
+    parser.add_argument('--output', default='benchmarks/results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='сравнить два JSON и выйти')
+    return parser.parse_args()
+
+
+def configure_env(args):
+    """Окружение до импорта app: его же унаследует gunicorn"""
+    if not os.getenv('DATABASE_URL'):
+        os.environ['SQLITE_PATH'] = args.sqlite_path or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+    os.environ['STATS_RECONCILE_INTERVAL'] = '0'
+    os.environ['NOTIFICATION_RETENTION_INTERVAL'] = '0'
+    # POST-сценарии повторяются с одного адреса сотни раз
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    if args.no_page_cache:
+        os.environ['PAGE_CACHE_TTL'] = '0'
+
+
+def seq_sql(app, rows, body):
+    """INSERT ... SELECT по последовательности n = 1..rows для обеих БД"""
+    if app.DB_TYPE == 'postgresql':
+        return body.format(seq=f'generate_series(1, {int(rows)}) AS s(n)', cte='')
+    return body.format(
+        seq='seq', cte=f'WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {int(rows)}) ')
+
+
+def text_expr(app, n_expr, count):
+    """SQL-выражение: count слов из WORDS, выбранных по n"""
+    words = ', '.join(f"'{w}'" for w in WORDS)
+    parts = []
+    for i in range(count):
+        index = f'((({n_expr}) * {7 + i * 13} + {i}) % {len(WORDS)})'
+        if app.DB_TYPE == 'postgresql':
+            parts.append(f'(ARRAY[{words}])[{index} + 1]')
+        else:
+            parts.append(f"json_extract('{json.dumps(WORDS, ensure_ascii=False)}', '$[' || {index} || ']')")
+    return " || ' ' || ".join(parts)
+
+
+def count_rows(cur, table):
+    cur.execute(f'SELECT COUNT(*) FROM {table}')
+    return cur.fetchone()[0]
+
+
+def seed(app, args):
+    conn = app.get_db()
+    cur = conn.cursor()
+    started = time.perf_counter()
+    now = "now() - (n || ' minutes')::interval" if app.DB_TYPE == 'postgresql' else "datetime('now', '-' || n || ' minutes')"
+    date = "to_char(now() - (n / 20 || ' days')::interval, 'YYYY-MM-DD')" if app.DB_TYPE == 'postgresql' \
+        else "date('now', '-' || (n / 20) || ' days')"
+
+    if count_rows(cur, 'feed_news') < args.feed:
+        cur.execute(seq_sql(app, args.feed, f"""
+            {{cte}}INSERT INTO feed_news(date, time, title, description, url)
+            SELECT {date}, '12:00', {text_expr(app, 'n', 5)}, {text_expr(app, 'n + 3', 30)}, '/news/' || n
+            FROM {{seq}}
+        """))
+        cur.execute(seq_sql(app, 20, """
+            {cte}INSERT INTO slider_news(date, title, description, image)
+            SELECT '2025-01-01', 'Слайд ' || n, 'описание', '/logo/logo.png' FROM {seq}
+        """))
+        conn.commit()
+
+    if count_rows(cur, 'complaints') < args.complaints:
+        cur.execute(seq_sql(app, args.complaints, """
+            {cte}INSERT INTO complaints(fio, nick_ds, violator_ds, violator_roblox, details, claimed_by)
+            SELECT 'Заявитель ' || n, 'nick' || n, 'v' || n, 'roblox' || n, 'подробности жалобы ' || n,
+                   CASE WHEN n % 3 = 0 THEN 'Прокурор' END
+            FROM {seq}
+        """))
+        cur.execute(seq_sql(app, args.complaints // 5, """
+            {cte}INSERT INTO job_applications(nick_ds, char_name, char_age, char_nationality, char_job, status)
+            SELECT 'nick' || n, 'Кандидат ' || n, 30, 'РФ', 'Следователь',
+                   CASE WHEN n % 5 = 0 THEN 'approved' ELSE 'pending' END
+            FROM {seq}
+        """))
+        cur.execute(seq_sql(app, args.prosecutors, """
+            {cte}INSERT INTO user_accounts(username, password, full_name, role)
+            SELECT 'bench_proc' || n, 'x', 'Прокурор ' || n, 'prosecutor' FROM {seq}
+        """))
+        conn.commit()
+
+    if count_rows(cur, 'notification_messages') < args.notifications:
+        # Половина — рассылки прокурорам (общая учетная запись и пользователи
+        # по кругу), половина — админу; 90% прочитаны
+        cur.execute(seq_sql(app, args.notifications, f"""
+            {{cte}}INSERT INTO notification_messages(title, message, type, created_at)
+            SELECT 'Новая жалоба получена', 'Поступила жалоба от ' || n, 'complaint', {now} FROM {{seq}}
+        """))
+        cur.execute('SELECT MIN(id) FROM notification_messages')
+        first_id = cur.fetchone()[0]
+        cur.execute('SELECT MIN(id), COUNT(*) FROM user_accounts WHERE role = ?', ('prosecutor',))
+        first_user, users = cur.fetchone()
+        cur.execute(f"""
+            INSERT INTO notification_recipients(recipient_role, recipient_id, message_id, is_read)
+            SELECT CASE WHEN id % 2 = 0 THEN 'admin' ELSE 'prosecutor' END,
+                   CASE WHEN id % 2 = 0 OR id % 4 = 1 THEN 0 ELSE {int(first_user or 0)} + id % {max(int(users), 1)} END,
+                   id, id % 10 <> 0
+            FROM notification_messages WHERE id >= ?
+        """, (first_id,))
+        cur.execute('DELETE FROM notification_unread_counters')
+        cur.execute("""
+            INSERT INTO notification_unread_counters(recipient_role, recipient_id, unread)
+            SELECT recipient_role, recipient_id, COUNT(*) FROM notification_recipients
+            WHERE is_read = FALSE GROUP BY recipient_role, recipient_id
+        """)
+        conn.commit()
+
+    app.recount_stats(cur)
+    cur.execute('ANALYZE')
+    conn.commit()
+    counts = {table: count_rows(cur, table) for table in
+              ('feed_news', 'notification_messages', 'notification_recipients', 'complaints', 'job_applications')}
+    conn.close()
+    app.page_cache.clear()
+    print(f'seeded in {time.perf_counter() - started:.1f}s: {counts}')
+    return counts
+
+
+def session_cookie(app, role):
+    """Подписанная cookie сессии Flask для роли (тот же SECRET_KEY у gunicorn)"""
+    if role is None:
+        return None
+    data = {'is_admin': True} if role == 'admin' else {'is_prosecutor': True, 'proc_name': 'Прокурор'}
+    value = app.app.session_interface.get_signing_serializer(app.app).dumps(data)
+    return f"{app.app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    if len(latencies) < 2:
+        return {'requests': len(latencies), 'errors': errors}
+    q = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'p50_ms': round(q[49] * 1000, 3),
+        'p95_ms': round(q[94] * 1000, 3),
+        'p99_ms': round(q[98] * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+    }
+
+
+def run_client(app, scenarios, args):
+    """Последовательно через WSGI test client: стоимость самого Flask-кода"""
+    results = {}
+    for name, method, path, data, role in scenarios:
+        client = app.app.test_client()
+        if role:
+            with client.session_transaction() as sess:
+                sess.update({'is_admin': True} if role == 'admin' else {'is_prosecutor': True, 'proc_name': 'Прокурор'})
+        latencies, errors = [], 0
+        for i in range(args.warmup + args.requests):
+            started = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            elapsed = time.perf_counter() - started
+            if response.status_code >= 400:
+                errors += 1
+            if i >= args.warmup:
+                latencies.append(elapsed)
+        total = sum(latencies)
+        results[name] = summarize(latencies, errors, total)
+        print(f"client {name}: {results[name]}")
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(args):
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(args.gunicorn_workers), '--log-level', 'warning'] + args.gunicorn_args.split()
+    process = subprocess.Popen(command, cwd=ROOT, env=os.environ.copy())
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {process.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/contacts', timeout=2).read()
+            return process, f'http://127.0.0.1:{port}'
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.3)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start in 60s')
+
+
+def http_request(base, method, path, data, cookie):
+    body = urllib.parse.urlencode(data).encode() if data else None
+    request = urllib.request.Request(base + urllib.parse.quote(path, safe='/?=&+'), data=body, method=method)
+    if cookie:
+        request.add_header('Cookie', cookie)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            ok = response.status < 400
+    except urllib.error.HTTPError as e:
+        ok = e.code in (301, 302, 303)  # POST форм может отвечать редиректом
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run_http(app, scenarios, args):
+    """Параллельные HTTP-запросы к gunicorn: реальная пропускная способность"""
+    process, base = start_gunicorn(args)
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for name, method, path, data, role in scenarios:
+                cookie = session_cookie(app, role)
+                list(pool.map(lambda _: http_request(base, method, path, data, cookie), range(args.warmup)))
+                started = time.perf_counter()
+                outcomes = list(pool.map(lambda _: http_request(base, method, path, data, cookie), range(args.requests)))
+                elapsed = time.perf_counter() - started
+                results[name] = summarize([t for t, _ in outcomes], sum(1 for _, ok in outcomes if not ok), elapsed)
+                print(f"http {name}: {results[name]}")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('label') or old_path} -> {new['meta'].get('label') or new_path}")
+    for mode, scenarios in new['results'].items():
+        for name, stats in scenarios.items():
+            before = old['results'].get(mode, {}).get(name)
+            if not before or 'p95_ms' not in before or 'p95_ms' not in stats:
+                continue
+            change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+            print(f"{mode:6} {name:26} p95 {before['p95_ms']:9.2f} -> {stats['p95_ms']:9.2f} ms ({change:+.0f}%)"
+                  f"   rps {before.get('rps', 0):8.1f} -> {stats.get('rps', 0):8.1f}")
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    configure_env(args)
+    import app  # noqa: E402  (init_db создает схему в тестовой базе)
+
+    counts = seed(app, args)
+    scenarios = [s for s in SCENARIOS if not args.only or s[0] in args.only.split(',')]
+    results = {}
+    if args.mode in ('client', 'both'):
+        results['client'] = run_client(app, scenarios, args)
+    if args.mode in ('http', 'both'):
+        results['http'] = run_http(app, scenarios, args)
+
+    report = {
+        'meta': {
+            'label': args.label,
+            'git': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'db': app.DB_TYPE,
+            'page_cache': not args.no_page_cache,
+            'rows': counts,
+            'args': {k: v for k, v in vars(args).items() if k not in ('compare', 'output')},
+        },
+        'results': results,
+    }
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
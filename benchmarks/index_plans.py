@@ -0,0 +1,155 @@
+"""Планы и время горячих запросов без индексов idx_* и с ними.
+
+Запуск (SQLite, временная база):
+    python benchmarks/index_plans.py --rows 1000000
+
+Для PostgreSQL задайте DATABASE_URL на пустую тестовую базу — таблицы
+notification_messages/notification_recipients/job_applications в ней
+будут заполнены синтетикой.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+if not os.getenv('DATABASE_URL'):
+    os.environ.setdefault('SQLITE_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+import app  # noqa: E402  (init_db создаёт схему во временной базе)
+
+QUERIES = {
+    'notifications_list': (
+        'SELECT m.id, m.title, m.message, m.type, r.is_read, m.created_at, m.data '
+        'FROM notification_recipients r JOIN notification_messages m ON m.id = r.message_id '
+        'WHERE r.recipient_role = ? AND r.recipient_id = ? '
+        'ORDER BY r.message_id DESC LIMIT 50',
+        ('prosecutor', 7),
+    ),
+    'unread_count': (
+        'SELECT unread FROM notification_unread_counters WHERE recipient_role = ? AND recipient_id = ?',
+        ('admin', 0),
+    ),
+    'unread_recount': (
+        'SELECT COUNT(*) FROM notification_recipients '
+        'WHERE recipient_role = ? AND recipient_id = ? AND is_read = FALSE',
+        ('admin', 0),
+    ),
+    'job_applications_approved': (
+        "SELECT COUNT(*) FROM job_applications WHERE status='approved'",
+        None,
+    ),
+    'login': (
+        'SELECT id, username, password, full_name, role FROM user_accounts WHERE username=?',
+        ('user42',),
+    ),
+}
+
+
+def seed(conn, rows):
+    """rows сообщений, у каждого один получатель (каждое третье — на всю роль)"""
+    cur = conn.cursor()
+    cur.execute('SELECT COUNT(*) FROM notification_recipients')
+    if cur.fetchone()[0] >= rows:
+        return
+    started = time.perf_counter()
+    if app.DB_TYPE == 'postgresql':
+        cur.execute(f"""
+            INSERT INTO notification_messages(id, title, message, type, created_at)
+            SELECT n, 't', 'm', 'complaint', now() - (n || ' seconds')::interval
+            FROM generate_series(1, {int(rows)}) AS n
+        """)
+        cur.execute("SELECT setval(pg_get_serial_sequence('notification_messages', 'id'), MAX(id)) FROM notification_messages")
+        cur.execute(f"""
+            INSERT INTO notification_recipients(recipient_role, recipient_id, message_id, is_read)
+            SELECT CASE WHEN n % 2 = 0 THEN 'admin' ELSE 'prosecutor' END,
+                   CASE WHEN n % 3 = 0 THEN 0 ELSE n % 500 END,
+                   n, n % 10 <> 0
+            FROM generate_series(1, {int(rows)}) AS n
+        """)
+        cur.execute("""
+            INSERT INTO job_applications(char_name, status)
+            SELECT 'c', CASE WHEN n % 5 = 0 THEN 'approved' ELSE 'pending' END
+            FROM generate_series(1, 50000) AS n
+        """)
+    else:
+        cur.execute(f"""
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {int(rows)})
+            INSERT INTO notification_messages(id, title, message, type, created_at)
+            SELECT n, 't', 'm', 'complaint', datetime('now', '-' || n || ' seconds') FROM seq
+        """)
+        cur.execute(f"""
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {int(rows)})
+            INSERT INTO notification_recipients(recipient_role, recipient_id, message_id, is_read)
+            SELECT CASE WHEN n % 2 = 0 THEN 'admin' ELSE 'prosecutor' END,
+                   CASE WHEN n % 3 = 0 THEN 0 ELSE n % 500 END,
+                   n, n % 10 <> 0
+            FROM seq
+        """)
+        cur.execute("""
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < 50000)
+            INSERT INTO job_applications(char_name, status)
+            SELECT 'c', CASE WHEN n % 5 = 0 THEN 'approved' ELSE 'pending' END FROM seq
+        """)
+    app.recount_unread(cur)
+    conn.commit()
+    print(f'seeded {rows} notifications in {time.perf_counter() - started:.1f}s')
+
+
+def index_definitions(cur):
+    """{имя: CREATE INDEX ...} для всех индексов idx_*"""
+    if app.DB_TYPE == 'postgresql':
+        cur.execute("SELECT indexname, indexdef FROM pg_indexes WHERE indexname LIKE 'idx\\_%'")
+    else:
+        cur.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND name LIKE 'idx\\_%' ESCAPE '\\'")
+    return {r[0]: r[1] for r in cur.fetchall()}
+
+
+def report(conn, label, repeat):
+    cur = conn.cursor()
+    cur.execute('ANALYZE')
+    conn.commit()
+    print(f'\n=== {label} ===')
+    for name, (sql, params) in QUERIES.items():
+        explain = 'EXPLAIN ' if app.DB_TYPE == 'postgresql' else 'EXPLAIN QUERY PLAN '
+        cur.execute(explain + sql, params)
+        plan = [' | '.join(str(v) for v in r) for r in cur.fetchall()]
+        started = time.perf_counter()
+        for _ in range(repeat):
+            cur.execute(sql, params)
+            cur.fetchall()
+        elapsed = (time.perf_counter() - started) / repeat * 1000
+        print(f'{name}: {elapsed:.2f} ms')
+        for line in plan:
+            print(f'    {line}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    conn = app.get_db()
+    seed(conn, args.rows)
+    cur = conn.cursor()
+
+    indexes = index_definitions(cur)
+    for name in indexes:
+        cur.execute(f'DROP INDEX {name}')
+    conn.commit()
+    report(conn, 'без индексов', args.repeat)
+
+    # Вернуть все снятые индексы, а не только индексы одной миграции
+    for definition in indexes.values():
+        cur.execute(definition)
+    conn.commit()
+    report(conn, 'с индексами', args.repeat)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Стоимость scrypt для PASSWORD_HASH_METHOD: задержка проверки пароля от N.
+
+Для каждого N (r и p фиксированы) пароль хэшируется --rounds раз, в том
+числе при --concurrency одновременных входах (несколько человек логинятся
+сразу, а ядер мало). Рекомендуется наибольшее N, у которого p95 укладывается
+в --budget-ms:
+    python benchmarks/kdf_cost.py --budget-ms 100 --concurrency 4 --output bench/kdf.json
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from werkzeug.security import generate_password_hash
+
+from hot_paths import git_revision, summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--log2-n', default='12,13,14,15,16,17', help='степени двойки для N')
+    parser.add_argument('-r', type=int, default=8)
+    parser.add_argument('-p', type=int, default=1)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1, help='одновременных проверок пароля')
+    parser.add_argument('--budget-ms', type=float, default=100, help='допустимая p95 задержка одной проверки')
+    parser.add_argument('--output', default='benchmarks/kdf_cost.json')
+    return parser.parse_args()
+
+
+def timed_hash(method):
+    started = time.perf_counter()
+    generate_password_hash('correct horse battery staple', method=method)
+    return time.perf_counter() - started
+
+
+def run(method, args):
+    timed_hash(method)  # прогрев
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(lambda _: timed_hash(method), range(args.rounds)))
+    result = summarize(latencies, 0, time.perf_counter() - started)
+    result['memory_mb'] = round(128 * int(method.split(':')[1]) * args.r / 2 ** 20, 1)
+    print(f"{method}: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, "
+          f"{result['memory_mb']} MB, {result['rps']} hashes/s")
+    return result
+
+
+def main():
+    args = parse_args()
+    methods = [f'scrypt:{2 ** int(k)}:{args.r}:{args.p}' for k in args.log2_n.split(',')]
+    results = {method: run(method, args) for method in methods}
+    fitting = [m for m in methods if results[m]['p95_ms'] <= args.budget_ms]
+    recommended = fitting[-1] if fitting else None
+    if recommended:
+        print(f'PASSWORD_HASH_METHOD={recommended}')
+    else:
+        print(f'no setting fits {args.budget_ms:g} ms at concurrency {args.concurrency}')
+
+    report = {
+        'meta': {
+            'git': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+        'recommended': recommended,
+    }
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
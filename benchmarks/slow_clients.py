@@ -0,0 +1,142 @@
+"""Медленные клиенты против классов воркеров gunicorn: задержка быстрых запросов.
+
+N клиентов одновременно медленно скачивают PDF (как посетитель на плохом
+мобильном интернете), а в это время измеряются p50/p95/p99 обычных
+запросов. Прогон повторяется для каждого класса воркеров с настройками из
+gunicorn.conf.py:
+    python benchmarks/slow_clients.py --worker-class sync,gthread,gevent --output bench/workers.json
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from hot_paths import free_port, git_revision, summarize
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--worker-class', default='sync,gthread,gevent')
+    parser.add_argument('--workers', type=int, default=2, help='WEB_CONCURRENCY')
+    parser.add_argument('--slow-clients', type=int, default=200)
+    parser.add_argument('--read-rate', type=int, default=64 * 1024, help='байт/с на медленного клиента')
+    parser.add_argument('--duration', type=float, default=20, help='секунд медленной загрузки')
+    parser.add_argument('--fast-requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--path', default='/pdf/1.pdf', help='что качают медленные клиенты')
+    parser.add_argument('--fast-path', default='/contacts')
+    parser.add_argument('--output', default='benchmarks/slow_clients.json')
+    return parser.parse_args()
+
+
+def start_gunicorn(worker_class, workers, env):
+    port = free_port()
+    env = dict(env, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(workers))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], cwd=ROOT, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn ({worker_class}) exited with code {process.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/contacts', timeout=2).read()
+            return process, port
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.3)
+    process.terminate()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not start in 60s')
+
+
+def slow_download(port, path, rate, stop, received):
+    """Качать path со скоростью rate байт/с, пока не выставлен stop"""
+    chunk = max(rate // 10, 1024)
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+            sock.sendall(f'GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n'.encode())
+            while not stop.is_set():
+                data = sock.recv(chunk)
+                if not data:
+                    break
+                received.append(len(data))
+                time.sleep(0.1)
+    except OSError:
+        pass
+
+
+def fast_request(port, path):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=10) as response:
+            response.read()
+            ok = response.status < 400
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run(worker_class, args, env):
+    process, port = start_gunicorn(worker_class, args.workers, env)
+    stop = threading.Event()
+    received = []
+    slow = [threading.Thread(target=slow_download, args=(port, args.path, args.read_rate, stop, received), daemon=True)
+            for _ in range(args.slow_clients)]
+    try:
+        for thread in slow:
+            thread.start()
+        time.sleep(1)  # медленные клиенты успевают занять воркеры
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(lambda _: fast_request(port, args.fast_path), range(args.fast_requests)))
+        elapsed = time.perf_counter() - started
+        time.sleep(max(0.0, args.duration - elapsed - 1))
+        result = summarize([t for t, ok in outcomes if ok], sum(1 for _, ok in outcomes if not ok), elapsed)
+        result['slow_clients_mb_received'] = round(sum(received) / 2 ** 20, 1)
+    finally:
+        stop.set()
+        for thread in slow:
+            thread.join(timeout=5)
+        process.terminate()
+        process.wait(timeout=15)
+    print(f'{worker_class}: {result}')
+    return result
+
+
+def main():
+    args = parse_args()
+    env = dict(os.environ)
+    if not env.get('DATABASE_URL'):
+        env['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    env.setdefault('STATS_RECONCILE_INTERVAL', '0')
+    env.setdefault('NOTIFICATION_RETENTION_INTERVAL', '0')
+
+    results = {worker_class: run(worker_class, args, env) for worker_class in args.worker_class.split(',')}
+    report = {
+        'meta': {
+            'git': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'cpus': os.cpu_count(),
+            'db': 'postgresql' if env.get('DATABASE_URL') else 'sqlite',
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
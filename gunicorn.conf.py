@@ -0,0 +1,50 @@
+"""Настройки gunicorn (gunicorn сам читает ./gunicorn.conf.py при запуске).
+
+По умолчанию — воркеры gthread (потоки). GUNICORN_WORKER_CLASS=gevent
+держит тысячи медленных клиентов и SSE-потоков на гринлетах, но годится
+только для PostgreSQL и без профилировщика: SQLite, Pillow, pypdfium2 и
+фоновые задачи блокируют весь воркер, а /admin/profiler не видит гринлеты.
+Все значения переопределяются переменными окружения, см. README, раздел
+«Режим воркеров».
+"""
+import importlib.util
+import os
+
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# gthread | gevent | sync (eventlet поддерживается, но не рекомендуется)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+# Потоков на воркер — только для gthread
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+# Одновременных соединений на воркер — только для gevent/eventlet
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 500))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Чьим X-Forwarded-Proto/For верить. По умолчанию, как в самом gunicorn, —
+# только локальному прокси; на Railway балансировщик не имеет постоянного
+# адреса, там задается FORWARDED_ALLOW_IPS=*
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1')
+accesslog = os.getenv('GUNICORN_ACCESSLOG') or None
+
+
+def post_fork(server, worker):
+    # psycopg2 блокирует на уровне C; psycogreen ставит wait-callback,
+    # чтобы ожидание ответа PostgreSQL переключало гринлеты
+    worker_type = server.cfg.worker_class_str
+    if worker_type in ('gevent', 'eventlet') and _installed('psycopg2'):
+        try:
+            module = importlib.import_module(f'psycogreen.{worker_type}')
+        except ImportError:
+            server.log.warning('psycogreen is not installed: PostgreSQL queries will block the %s worker', worker_type)
+            return
+        module.patch_psycopg()